@@ -1,35 +1,138 @@
-from fastapi import APIRouter, Query, HTTPException
-from fastapi.responses import Response
+from fastapi import APIRouter, Depends, Header, Query, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from typing import AsyncIterator, List, Optional, Tuple, Union
+import asyncio
+import contextlib
+import hashlib
 import httpx
 import json
 import logging
 import os
-import subprocess
+import pydantic
+import re
 import tempfile
 import time
-import shutil
+from api.avif_transcoder import (
+    OutputSpec, Overloaded, TranscodeError, ffmpeg_version, scheduler, transcode, transcode_stream,
+)
+from api.common import metrics
+from api.common.cache import CACHE_BACKEND, DiskCache, LRUCache, create_cache
+from api.common.http_client import get_http_client, host_semaphore
+from api.common.metrics import phase
+from api.common.responses import etag_matches
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-@router.get("/to")
-async def convert_avif_to_png(
-    url: str = Query(..., description="AVIF图片URL"),
-    options: str = Query(None, description="自定义请求头JSON")
-):
-    
-    headers = {}
-    if options:
-        try:
-            headers = json.loads(options)
-        except json.JSONDecodeError:
-            logger.warning("Invalid JSON in options, using empty headers")
-    
+# 转换结果按内容寻址缓存：输出 key = sha256(源文件哈希 + 转换参数)
+# 内存层按字节数限制，磁盘层按目录总大小限制；URL -> 源文件哈希的索引记录上游的 ETag/Last-Modified
+memory_cache = LRUCache(
+    max_entries=int(os.getenv("AVIF_MEMORY_CACHE_ENTRIES", "4096")),
+    max_bytes=int(os.getenv("AVIF_MEMORY_CACHE_BYTES", str(64 * 1024 * 1024))),
+)
+# CACHE_BACKEND=sqlite 时第二层和 URL 索引放进多个 worker 共享的 SQLite 库；
+# DiskCache 的索引在每个进程里各有一份，别的 worker 写入的文件看不到
+if CACHE_BACKEND == "sqlite":
+    disk_cache = create_cache(
+        "avif_output",
+        max_entries=1 << 30,
+        max_bytes=int(os.getenv("AVIF_DISK_CACHE_BYTES", str(512 * 1024 * 1024))),
+    )
+else:
+    disk_cache = DiskCache(
+        os.getenv("AVIF_DISK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "avif-cache")),
+        max_bytes=int(os.getenv("AVIF_DISK_CACHE_BYTES", str(512 * 1024 * 1024))),
+    )
+url_index = create_cache(
+    "avif_url_index", max_entries=int(os.getenv("AVIF_URL_INDEX_ENTRIES", "8192")), max_bytes=8 * 1024 * 1024
+)
+CACHE_CONTROL = os.getenv("AVIF_CACHE_CONTROL", "public, max-age=86400")
+# 源图片大小上限，超过时提前中止下载；stream 模式下输出不超过 AVIF_STREAM_CACHE_MAX_BYTES 才写入缓存
+MAX_INPUT_BYTES = int(os.getenv("AVIF_MAX_INPUT_BYTES", str(20 * 1024 * 1024)))
+STREAM_CACHE_MAX_BYTES = int(os.getenv("AVIF_STREAM_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+BATCH_MAX = int(os.getenv("AVIF_BATCH_MAX", "50"))
 
-    start_time = time.time()
-    async with httpx.AsyncClient() as client:
+metrics.register_collector("aviftonpng", lambda: [
+    *metrics.stats_samples("cache", memory_cache.stats(), {"cache": "avif_memory"}),
+    *metrics.stats_samples("cache", disk_cache.stats(), {"cache": "avif_disk"}),
+    *metrics.stats_samples("cache", url_index.stats(), {"cache": "avif_url_index"}),
+    *metrics.stats_samples("transcode", {
+        key: value for key, value in scheduler.stats().items() if not isinstance(value, dict)
+    }),
+])
+
+
+def output_key(source_hash: str, output_format: str = "png") -> str:
+    return hashlib.sha256(f"{source_hash}:{output_format}".encode()).hexdigest()
+
+
+def _overloaded(e: Overloaded) -> HTTPException:
+    logger.warning(f"转码队列已满，拒绝请求（Retry-After: {e.retry_after}s）")
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+async def get_converted(key: str) -> Optional[bytes]:
+    data = memory_cache.get(key)
+    if data is None:
+        data = await run_in_threadpool(disk_cache.get, key)
+        if data is not None:
+            memory_cache.set(key, data)
+    return data
+
+
+async def put_converted(key: str, data: bytes) -> None:
+    memory_cache.set(key, data)
+    try:
+        await run_in_threadpool(disk_cache.set, key, data)
+    except OSError as e:
+        logger.warning(f"写入磁盘缓存失败: {e}")
+
+
+def _conditional_headers(headers: dict, indexed: Optional[dict]) -> dict:
+    request_headers = dict(headers)
+    if indexed:
+        if indexed.get("etag"):
+            request_headers.setdefault("If-None-Match", indexed["etag"])
+        if indexed.get("last_modified"):
+            request_headers.setdefault("If-Modified-Since", indexed["last_modified"])
+    return request_headers
+
+
+async def _remember_source(index_key, resp: httpx.Response, source_hash: str) -> None:
+    await url_index.aset(index_key, {
+        "source": source_hash,
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+    })
+
+
+async def _iter_capped(resp: httpx.Response, hasher) -> AsyncIterator[bytes]:
+    """逐块读取上游响应并计算哈希，超过 MAX_INPUT_BYTES 立即中止"""
+    received = 0
+    async for chunk in resp.aiter_bytes():
+        received += len(chunk)
+        if received > MAX_INPUT_BYTES:
+            raise HTTPException(status_code=413, detail=f"源图片超过大小上限 {MAX_INPUT_BYTES} bytes")
+        hasher.update(chunk)
+        yield chunk
+
+
+async def _open_source(client: httpx.AsyncClient, url: str, headers: dict, index_key):
+    """
+    发起下载请求，返回 (已打开的流式响应, URL 索引记录)。
+
+    URL 索引里有记录时带上 If-None-Match / If-Modified-Since；上游返回 304 时响应为 None。
+    """
+    indexed = await url_index.aget(index_key)
+    request = client.build_request("GET", url, headers=_conditional_headers(headers, indexed), timeout=15.0)
+    try:
+        resp = await client.send(request, stream=True)
+        if resp.status_code == 304 and indexed:
+            await resp.aclose()
+            logger.info(f"上游未修改: {url}")
+            return None, indexed
         try:
-            resp = await client.get(url, headers=headers, timeout=15.0)
             resp.raise_for_status()
             
             if resp.status_code != 200:
@@ -37,92 +140,338 @@ async def convert_avif_to_png(
                     status_code=400, 
                     detail=f"服务器返回错误状态码: {resp.status_code}"
                 )
-                
-            logger.info(f"下载完成: {len(resp.content)} bytes in {time.time()-start_time:.2f}s")
-                
-        except httpx.HTTPError as e:
+
+            length = resp.headers.get("Content-Length")
+            if length and length.isdigit() and int(length) > MAX_INPUT_BYTES:
+                raise HTTPException(status_code=413, detail=f"源图片超过大小上限 {MAX_INPUT_BYTES} bytes")
+        except BaseException:
+            await resp.aclose()
+            raise
+        return resp, indexed
+            
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
+        logger.error(f"下载失败: {str(e)}")
+        raise HTTPException(
+            status_code=400, 
+            detail=f"下载失败: {str(e)}"
+        )
+    except Exception as e:
+        logger.error(f"请求异常: {str(e)}")
+        raise HTTPException(
+            status_code=500, 
+            detail=f"请求异常: {str(e)}"
+        )
+
+
+async def _download(client: httpx.AsyncClient, url: str, headers: dict, index_key) -> Tuple[Optional[bytes], str]:
+    """下载源图片，返回 (内容, 源文件哈希)；上游返回 304 时内容为 None，直接沿用索引中的哈希"""
+    start_time = time.time()
+    resp, indexed = await _open_source(client, url, headers, index_key)
+    if resp is None:
+        return None, indexed["source"]
+
+    hasher = hashlib.sha256()
+    try:
+        content = b"".join([chunk async for chunk in _iter_capped(resp, hasher)])
+    except httpx.HTTPError as e:
+        logger.error(f"下载失败: {str(e)}")
+        raise HTTPException(
+            status_code=400, 
+            detail=f"下载失败: {str(e)}"
+        )
+    finally:
+        await resp.aclose()
+    logger.info(f"下载完成: {len(content)} bytes in {time.time()-start_time:.2f}s")
+
+    source_hash = hasher.hexdigest()
+    await _remember_source(index_key, resp, source_hash)
+    return content, source_hash
+
+
+async def _convert_streaming(
+    client: httpx.AsyncClient, url: str, headers: dict, index_key, spec: OutputSpec, if_none_match: Optional[str]
+):
+    """
+    流式转换：下载到的数据块直接喂给 ffmpeg，输出边转边发给客户端。
+
+    在返回响应之前先等到第一块输出，这样下载失败、超过大小上限、ffmpeg 无法识别输入等错误
+    仍然能以正常的 HTTP 错误码返回。转码名额一直持有到响应体发送完毕。
+    """
+    resp, indexed = await _open_source(client, url, headers, index_key)
+    if resp is None:
+        key = output_key(indexed["source"], spec.key)
+        response_headers = {"ETag": f'"{key}"', "Cache-Control": CACHE_CONTROL}
+        if etag_matches(if_none_match, response_headers["ETag"]):
+            return Response(status_code=304, headers=response_headers)
+        cached = await get_converted(key)
+        if cached is not None:
+            return Response(content=cached, media_type=spec.media_type, headers=response_headers)
+        # 上游未修改但转换结果已被淘汰，重新完整下载
+        await url_index.apop(index_key)
+        resp, _ = await _open_source(client, url, headers, index_key)
+
+    slot = scheduler.slot()
+    try:
+        await slot.__aenter__()
+    except BaseException as e:
+        await resp.aclose()
+        if isinstance(e, Overloaded):
+            raise _overloaded(e)
+        raise
+
+    hasher = hashlib.sha256()
+    output = transcode_stream(_iter_capped(resp, hasher), spec)
+    try:
+        first = await output.__anext__()
+    except BaseException as e:
+        await output.aclose()
+        await resp.aclose()
+        await slot.__aexit__(type(e), e, e.__traceback__)
+        if isinstance(e, StopAsyncIteration):
+            raise HTTPException(status_code=500, detail="转换失败: FFmpeg 没有输出")
+        if isinstance(e, httpx.HTTPError):
             logger.error(f"下载失败: {str(e)}")
-            raise HTTPException(
-                status_code=400, 
-                detail=f"下载失败: {str(e)}"
-            )
-        except Exception as e:
-            logger.error(f"请求异常: {str(e)}")
-            raise HTTPException(
-                status_code=500, 
-                detail=f"请求异常: {str(e)}"
-            )
-    
+            raise HTTPException(status_code=400, detail=f"下载失败: {str(e)}")
+        if isinstance(e, TranscodeError):
+            raise HTTPException(status_code=500, detail=f"转换失败: {str(e)}")
+        raise
+
+    async def body():
+        # 输出不超过 STREAM_CACHE_MAX_BYTES 时顺便写入缓存，超过则放弃缓存以保持内存有界
+        collected = [first]
+        size = len(first)
+        error = None
+        try:
+            yield first
+            async for chunk in output:
+                size += len(chunk)
+                if collected is not None:
+                    if size <= STREAM_CACHE_MAX_BYTES:
+                        collected.append(chunk)
+                    else:
+                        collected = None
+                yield chunk
+        except BaseException as e:
+            # 响应头已经发出，只能中断连接让客户端知道图片不完整
+            error = e
+            if isinstance(e, Exception):
+                logger.error(f"流式转换中断: {str(e)}")
+            raise
+        finally:
+            await output.aclose()
+            await resp.aclose()
+            await slot.__aexit__(type(error) if error else None, error, None)
+
+        source_hash = hasher.hexdigest()
+        await _remember_source(index_key, resp, source_hash)
+        if collected is not None:
+            await put_converted(output_key(source_hash, spec.key), b"".join(collected))
+
+    return StreamingResponse(body(), media_type=spec.media_type, headers={"Cache-Control": CACHE_CONTROL})
+
+
+def _parse_options(options) -> dict:
+    if isinstance(options, dict):
+        return options
+    if options:
+        try:
+            return json.loads(options)
+        except json.JSONDecodeError:
+            logger.warning("Invalid JSON in options, using empty headers")
+    return {}
+
+
+def _index_key(url: str, headers: dict):
+    # 自定义请求头可能影响上游返回的内容，所以也作为索引键的一部分
+    return (url, json.dumps(headers, sort_keys=True))
+
+
+async def _convert(
+    client: httpx.AsyncClient,
+    url: str,
+    headers: dict,
+    spec: OutputSpec,
+    if_none_match: Optional[str] = None,
+    fanout: bool = False,
+    gate: Optional[asyncio.Semaphore] = None,
+) -> Tuple[str, Optional[bytes]]:
+    """
+    下载并转换一张图片，返回 (输出 key, 转换结果)；命中缓存时不转码。
+
+    if_none_match 与输出 key 匹配时返回的转换结果为 None，调用方应回复 304。
+    批量接口传入 fanout=True，下载期间占用该主机的并发信号量（转码时不占用）；
+    gate 限制同一批里同时进入转码队列的数量。
+    """
+    index_key = _index_key(url, headers)
+
+    async def download():
+        with phase("upstream"):
+            async with host_semaphore(url) if fanout else contextlib.nullcontext():
+                return await _download(client, url, headers, index_key)
+
+    avif_data, source_hash = await download()
+    key = output_key(source_hash, spec.key)
+    if etag_matches(if_none_match, f'"{key}"'):
+        return key, None
+
+    output_data = await get_converted(key)
+    if output_data is not None:
+        return key, output_data
+
+    if avif_data is None:
+        # 上游返回 304 但转换结果已被淘汰，只能重新完整下载
+        await url_index.apop(index_key)
+        avif_data, source_hash = await download()
+        key = output_key(source_hash, spec.key)
 
-    avif_path = None
-    png_path = None
     try:
         start_time = time.time()
-        
-
-        temp_dir = tempfile.mkdtemp()
-        
-
-        avif_path = os.path.join(temp_dir, "input.avif")
-        with open(avif_path, "wb") as f:
-            f.write(resp.content)
-        
-
-        png_path = os.path.join(temp_dir, "output.png")
-        
-        
-        cmd = [
-            "ffmpeg",
-            "-y",  
-            "-i", avif_path,
-            "-frames:v", "1",  
-            png_path
-        ]
-        
-        #  FFmpeg 
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=10  
-        )
-        
-        # 检查转换结果
-        if result.returncode != 0:
-            error_msg = result.stderr.decode("utf-8", errors="ignore")
-            logger.error(f"FFmpeg 转换失败: {error_msg}")
-            raise RuntimeError(f"FFmpeg 错误: {error_msg}")
-        
-        # 读取 PNG 文件
-        with open(png_path, "rb") as f:
-            png_data = f.read()
-        
-        logger.info(f"转换完成: {len(png_data)} bytes in {time.time()-start_time:.2f}s")
-        
+        async with gate if gate is not None else contextlib.nullcontext():
+            async with scheduler.slot():
+                with phase("transcode"):
+                    output_data = await transcode(avif_data, spec)
+        logger.info(f"转换完成: {len(output_data)} bytes ({spec.key}) in {time.time()-start_time:.2f}s")
+    except Overloaded as e:
+        raise _overloaded(e)
     except Exception as e:
         logger.error(f"转换失败: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=500, 
             detail=f"转换失败: {str(e)}"
         )
-    finally:
-        # 清理临时文件
-        if temp_dir and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+
+    await put_converted(key, output_data)
+    return key, output_data
+
+
+@router.get("/to")
+async def convert_avif_to_png(
+    url: str = Query(..., description="AVIF图片URL"),
+    options: str = Query(None, description="自定义请求头JSON"),
+    stream: bool = Query(False, description="为true时边下载边转换，并以流的形式返回图片"),
+    format: str = Query("png", regex="^(png|webp|jpeg)$", description="输出格式：png / webp / jpeg"),
+    width: Optional[int] = Query(None, ge=1, le=4096, description="输出宽度，只给宽度时按比例缩放"),
+    height: Optional[int] = Query(None, ge=1, le=4096, description="输出高度，宽高都给时缩放到不超过该尺寸"),
+    quality: Optional[int] = Query(None, ge=1, le=100, description="webp / jpeg 的输出质量"),
+    if_none_match: Optional[str] = Header(None),
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
     
-    return Response(content=png_data, media_type="image/png")
+    headers = _parse_options(options)
+    spec = OutputSpec(format, width, height, quality)
+    if stream:
+        return await _convert_streaming(client, url, headers, _index_key(url, headers), spec, if_none_match)
+
+    key, output_data = await _convert(client, url, headers, spec, if_none_match)
+    response_headers = {"ETag": f'"{key}"', "Cache-Control": CACHE_CONTROL}
+    if output_data is None:
+        return Response(status_code=304, headers=response_headers)
+    return Response(content=output_data, media_type=spec.media_type, headers=response_headers)
+
+
+class BatchArgs(pydantic.BaseModel):
+    urls: List[str]
+    # 与 /to 的 options 相同：自定义请求头，可以是 JSON 字符串或对象，对整批图片生效
+    options: Optional[Union[dict, str]] = None
+    format: str = pydantic.Field("png", regex="^(png|webp|jpeg)$")
+    width: Optional[int] = pydantic.Field(None, ge=1, le=4096)
+    height: Optional[int] = pydantic.Field(None, ge=1, le=4096)
+    quality: Optional[int] = pydantic.Field(None, ge=1, le=100)
+
+
+@router.post("/batch")
+async def convert_batch(
+    args: BatchArgs,
+    request: Request,
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
+    """
+    批量转换，用于画廊等一屏需要几十张图片的页面。
+
+    所有图片共用连接池并发下载（同一上游主机的并发数受 HTTP_FANOUT_PER_HOST 限制），
+    通过和 /to 相同的转码队列转换（同一批最多同时占用 workers + 队列长度个名额），
+    结果写入缓存后只返回清单，客户端再按清单里的地址取图。
+
+    返回:
+    - items: 与 urls 顺序一致；成功时为 {"url", "key", "etag", "media_type", "size", "href"}，
+      失败时为 {"url", "error": {"c": 状态码, "m": 消息}}，转码队列满时额外带 retry_after
+    """
+    if len(args.urls) > BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"一次最多转换{BATCH_MAX}张图片")
+
+    headers = _parse_options(args.options)
+    spec = OutputSpec(args.format, args.width, args.height, args.quality)
+
+    # 同一批最多同时占用「运行 + 排队」那么多个转码名额，空闲时一批图片不会因为自己把队列挤满而被拒绝；
+    # 其余的在这里等待，不计入转码队列
+    gate = asyncio.Semaphore(scheduler.workers + scheduler.max_queue)
+    # 重复的 URL 只转换一次
+    unique_urls = list(dict.fromkeys(args.urls))
+    results = await asyncio.gather(
+        *(_convert(client, url, headers, spec, fanout=True, gate=gate) for url in unique_urls),
+        return_exceptions=True,
+    )
+
+    by_url = {}
+    for url, result in zip(unique_urls, results):
+        if isinstance(result, HTTPException):
+            error = {"c": str(result.status_code), "m": result.detail}
+            if result.headers and "Retry-After" in result.headers:
+                error["retry_after"] = int(result.headers["Retry-After"])
+            by_url[url] = {"url": url, "error": error}
+        elif isinstance(result, BaseException):
+            logger.error(f"批量转换失败: {url}: {result}")
+            by_url[url] = {"url": url, "error": {"c": "500", "m": f"转换失败: {str(result)}"}}
+        else:
+            key, output_data = result
+            by_url[url] = {
+                "url": url,
+                "key": key,
+                "etag": f'"{key}"',
+                "media_type": spec.media_type,
+                "size": len(output_data),
+                "href": f"{request.url_for('get_result', key=key)}?format={spec.format}",
+            }
+    return {"items": [by_url[url] for url in args.urls]}
+
+
+_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+@router.get("/result/{key}")
+async def get_result(
+    key: str,
+    format: str = Query("png", regex="^(png|webp|jpeg)$", description="输出格式，决定 Content-Type"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """按 /batch 返回的 key 读取已缓存的转换结果；缓存已被淘汰时返回 404，客户端应回退到 /to"""
+    if not _KEY_PATTERN.match(key):
+        raise HTTPException(status_code=400, detail="无效的 key")
+    response_headers = {"ETag": f'"{key}"', "Cache-Control": CACHE_CONTROL}
+    if etag_matches(if_none_match, response_headers["ETag"]):
+        return Response(status_code=304, headers=response_headers)
+    data = await get_converted(key)
+    if data is None:
+        raise HTTPException(status_code=404, detail="转换结果不存在或已过期")
+    return Response(content=data, media_type=OutputSpec(format).media_type, headers=response_headers)
+
+
+@router.get("/cache")
+async def cache_stats():
+    """转换结果缓存的命中统计"""
+    return {"memory": memory_cache.stats(), "disk": disk_cache.stats(), "url_index": url_index.stats()}
+
+@router.get("/stats")
+async def transcode_stats():
+    """转码队列深度、运行中的任务数，以及最近任务的排队/运行耗时"""
+    return scheduler.stats()
 
 @router.get("/ffmpeg-version")
 async def get_ffmpeg_version():
     """检查 FFmpeg 是否可用及其版本"""
     try:
-        result = subprocess.run(
-            ["ffmpeg", "-version"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=5
-        )
-        version_output = result.stdout.decode("utf-8", errors="ignore").split("\n")[0]
-        return {"version": version_output}
+        return {"version": await ffmpeg_version()}
     except Exception as e:
         return {"error": str(e)}
\ No newline at end of file
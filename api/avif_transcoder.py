@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+"""
+基于 asyncio 子进程的 FFmpeg 转码管道。
+
+输入通过 stdin（pipe:0）写给 ffmpeg，输出从 stdout（pipe:1）读回，不落盘；
+等待子进程时不阻塞事件循环，超时或请求被取消时会杀掉 ffmpeg 进程。
+
+- transcode: 一次性输入 bytes，返回完整输出
+- transcode_stream: 输入是异步字节流（例如边下载边喂给 ffmpeg），输出也按块产出
+- TranscodeScheduler: 限制同时运行的 ffmpeg 数量，排队超过上限时直接拒绝
+
+可通过环境变量调整：
+- FFMPEG_BIN: ffmpeg 可执行文件，默认 ffmpeg
+- FFMPEG_TIMEOUT: 单次转码超时（秒），默认 10
+- TRANSCODE_WORKERS: 同时运行的 ffmpeg 进程数，默认 CPU 核数
+- TRANSCODE_QUEUE_SIZE: 等待中的转码任务上限，默认 TRANSCODE_WORKERS * 4
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, List, NamedTuple, Optional
+
+from api.common.metrics import record_phase
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+FFMPEG_TIMEOUT = float(os.getenv("FFMPEG_TIMEOUT", "10"))
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", str(os.cpu_count() or 1)))
+TRANSCODE_QUEUE_SIZE = int(os.getenv("TRANSCODE_QUEUE_SIZE", str(TRANSCODE_WORKERS * 4)))
+
+MEDIA_TYPES = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+DEFAULT_QUALITY = {"webp": 80, "jpeg": 85}
+
+
+class TranscodeError(RuntimeError):
+    pass
+
+
+class OutputSpec(NamedTuple):
+    """
+    输出参数。
+
+    - format: png / webp / jpeg
+    - width / height: 只给一个时按比例缩放；两个都给时缩放到不超过该尺寸（保持比例）
+    - quality: 1-100，对 webp / jpeg 有效，默认见 DEFAULT_QUALITY；png 是无损格式，忽略此参数
+    """
+    format: str = "png"
+    width: Optional[int] = None
+    height: Optional[int] = None
+    quality: Optional[int] = None
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.format]
+
+    @property
+    def key(self) -> str:
+        """用于缓存键的规范化描述，png 且不缩放时保持为 "png" """
+        parts = [self.format]
+        if self.format in DEFAULT_QUALITY:
+            parts.append(f"q{self.quality or DEFAULT_QUALITY[self.format]}")
+        if self.width or self.height:
+            parts.append(f"{self.width or 0}x{self.height or 0}")
+        return ":".join(parts)
+
+
+def _scale_filter(spec: OutputSpec) -> Optional[str]:
+    if spec.width and spec.height:
+        return f"scale={spec.width}:{spec.height}:force_original_aspect_ratio=decrease"
+    if spec.width:
+        return f"scale={spec.width}:-2"
+    if spec.height:
+        return f"scale=-2:{spec.height}"
+    return None
+
+
+def build_command(spec: OutputSpec = OutputSpec()) -> List[str]:
+    if spec.format not in MEDIA_TYPES:
+        raise TranscodeError(f"不支持的输出格式: {spec.format}")
+
+    cmd = [
+        FFMPEG_BIN,
+        "-hide_banner",
+        "-loglevel", "error",
+        "-i", "pipe:0",
+        "-frames:v", "1",
+    ]
+    scale = _scale_filter(spec)
+    if scale:
+        cmd += ["-vf", scale]
+
+    quality = spec.quality or DEFAULT_QUALITY.get(spec.format)
+    if spec.format == "png":
+        cmd += ["-c:v", "png", "-f", "image2pipe"]
+    elif spec.format == "webp":
+        cmd += ["-c:v", "libwebp", "-quality", str(quality), "-f", "webp"]
+    else:
+        # mjpeg 的 -q:v 取值 2（最好）到 31（最差）
+        qscale = round(31 - (quality / 100) * 29)
+        cmd += ["-c:v", "mjpeg", "-pix_fmt", "yuvj420p", "-q:v", str(qscale), "-f", "image2pipe"]
+    cmd.append("pipe:1")
+    return cmd
+
+
+async def _kill(proc: asyncio.subprocess.Process) -> None:
+    if proc.returncode is None:
+        proc.kill()
+        await proc.wait()
+
+
+async def _spawn(spec: OutputSpec) -> asyncio.subprocess.Process:
+    try:
+        return await asyncio.create_subprocess_exec(
+            *build_command(spec),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise TranscodeError(f"找不到 FFmpeg: {FFMPEG_BIN}")
+
+
+async def transcode(data: bytes, spec: OutputSpec = OutputSpec(), timeout: float = FFMPEG_TIMEOUT) -> bytes:
+    """把 AVIF 字节按 spec 转换（默认 PNG）"""
+    proc = await _spawn(spec)
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(data), timeout)
+    except asyncio.TimeoutError:
+        raise TranscodeError(f"FFmpeg 超时（{timeout}s）")
+    finally:
+        # 超时、请求被取消等情况下不留下孤儿进程
+        await _kill(proc)
+
+    if proc.returncode != 0:
+        error_msg = stderr.decode("utf-8", errors="ignore")
+        logger.error(f"FFmpeg 转换失败: {error_msg}")
+        raise TranscodeError(f"FFmpeg 错误: {error_msg}")
+    return stdout
+
+
+async def transcode_stream(
+    source: AsyncIterator[bytes],
+    spec: OutputSpec = OutputSpec(),
+    timeout: float = FFMPEG_TIMEOUT,
+    chunk_size: int = 64 * 1024,
+) -> AsyncIterator[bytes]:
+    """
+    流式转码：source 的数据块一到就写进 ffmpeg 的 stdin，ffmpeg 的输出按块产出。
+
+    source 抛出的异常（例如超过大小上限）会终止 ffmpeg 并原样抛给调用方。
+    timeout 从开始转码算起，覆盖整个下载 + 转码过程。
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    proc = await _spawn(spec)
+
+    async def pump():
+        try:
+            async for chunk in source:
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg 提前退出，错误信息以它的退出码和 stderr 为准
+            pass
+        finally:
+            if not proc.stdin.is_closing():
+                proc.stdin.close()
+
+    pump_task = asyncio.ensure_future(pump())
+    stderr_task = asyncio.ensure_future(proc.stderr.read())
+    try:
+        while True:
+            read_task = asyncio.ensure_future(proc.stdout.read(chunk_size))
+            done, _ = await asyncio.wait(
+                {read_task, pump_task},
+                timeout=deadline - loop.time(),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if pump_task in done and pump_task.exception() is not None:
+                read_task.cancel()
+                raise pump_task.exception()
+            if read_task not in done:
+                if not done:
+                    read_task.cancel()
+                    raise TranscodeError(f"FFmpeg 超时（{timeout}s）")
+                # 输入刚写完，继续等输出
+                await asyncio.wait({read_task}, timeout=deadline - loop.time())
+                if not read_task.done():
+                    read_task.cancel()
+                    raise TranscodeError(f"FFmpeg 超时（{timeout}s）")
+            chunk = read_task.result()
+            if not chunk:
+                break
+            yield chunk
+
+        await pump_task
+        try:
+            returncode = await asyncio.wait_for(proc.wait(), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            raise TranscodeError(f"FFmpeg 超时（{timeout}s）")
+        if returncode != 0:
+            error_msg = (await stderr_task).decode("utf-8", errors="ignore")
+            logger.error(f"FFmpeg 转换失败: {error_msg}")
+            raise TranscodeError(f"FFmpeg 错误: {error_msg}")
+    finally:
+        pump_task.cancel()
+        await _kill(proc)
+        stderr_task.cancel()
+
+
+class Overloaded(Exception):
+    """转码队列已满"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"转码队列已满，请 {retry_after}s 后重试")
+        self.retry_after = retry_after
+
+
+class TranscodeScheduler:
+    """
+    转码准入控制：最多 workers 个任务同时运行，最多 max_queue 个任务排队，
+    队列满时立即抛出 Overloaded，而不是让请求无限堆积把机器拖垮。
+
+    用法:
+        async with scheduler.slot():
+            await transcode(...)
+
+    流式响应需要跨越处理函数持有名额时，可以手动调用 slot() 返回对象的 __aenter__/__aexit__。
+    """
+
+    def __init__(self, workers: int = TRANSCODE_WORKERS, max_queue: int = TRANSCODE_QUEUE_SIZE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        # 最近任务的 (排队耗时, 运行耗时)
+        self._timings: Deque[tuple] = deque(maxlen=256)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def slot(self) -> "_Slot":
+        return _Slot(self)
+
+    def _acquire_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        return self._semaphore
+
+    def retry_after(self) -> int:
+        """按最近的平均运行耗时估算队列清空所需的秒数"""
+        runs = [run for _, run in self._timings]
+        avg_run = sum(runs) / len(runs) if runs else 1.0
+        return max(1, math.ceil((self.waiting / self.workers + 1) * avg_run))
+
+    def _record(self, wait: float, run: float) -> None:
+        self._timings.append((wait, run))
+
+    def stats(self) -> dict:
+        def summary(values):
+            if not values:
+                return {"avg_ms": None, "p95_ms": None}
+            ordered = sorted(values)
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            return {"avg_ms": round(sum(values) / len(values) * 1000, 1), "p95_ms": round(p95 * 1000, 1)}
+
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queue_depth": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait": summary([wait for wait, _ in self._timings]),
+            "run": summary([run for _, run in self._timings]),
+        }
+
+
+class _Slot:
+    def __init__(self, scheduler: TranscodeScheduler):
+        self.scheduler = scheduler
+        self._started: Optional[float] = None
+        self._enqueued: Optional[float] = None
+
+    async def __aenter__(self):
+        scheduler = self.scheduler
+        semaphore = scheduler._acquire_semaphore()
+        if semaphore.locked() and scheduler.waiting >= scheduler.max_queue:
+            scheduler.rejected += 1
+            raise Overloaded(scheduler.retry_after())
+
+        self._enqueued = time.monotonic()
+        scheduler.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            scheduler.waiting -= 1
+        self._started = time.monotonic()
+        scheduler.running += 1
+        record_phase("queue", self._started - self._enqueued)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        scheduler = self.scheduler
+        scheduler.running -= 1
+        scheduler._semaphore.release()
+        if exc_type is None:
+            scheduler.completed += 1
+        else:
+            scheduler.failed += 1
+        now = time.monotonic()
+        scheduler._record(self._started - self._enqueued, now - self._started)
+        return False
+
+
+scheduler = TranscodeScheduler()
+
+
+async def ffmpeg_version(timeout: float = 5) -> str:
+    proc = await asyncio.create_subprocess_exec(
+        FFMPEG_BIN, "-version",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    finally:
+        await _kill(proc)
+    return stdout.decode("utf-8", errors="ignore").split("\n")[0]
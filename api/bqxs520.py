@@ -1,20 +1,86 @@
-from fastapi import APIRouter, Query, Request
-import json
-from bs4 import BeautifulSoup
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 import httpx
-from lxml import etree
 import re
 import asyncio
+import contextlib
+import logging
+import os
+import typing
+import pydantic
 from urllib.parse import quote
-from playwright.async_api import async_playwright
+from api.bqxs520_chapters import ChapterFetchError, chapter_indexes, chapter_stats, get_chapter_index
+from api.bqxs520_parser import ParseError, SearchStreamParser, parse_detail, parse_search
+from api.common.cache import create_cache
+from api.common import metrics
+from api.common.http_client import get_http_client, host_semaphore
+from api.common.metrics import phase
+from api.common.parse_pool import run_incremental, run_parser
+from api.common.responses import FastJSONResponse, dumps, revalidating_json
 
 # 创建一个APIRouter实例
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# 可以指向本地的模拟服务做基准测试，见 bench/stub_upstream.py
+BQXS520_BASE_URL = os.getenv("BQXS520_BASE_URL", "https://www.bqxs520.com").rstrip("/")
+DETAIL_BATCH_MAX = int(os.getenv("BQXS520_DETAIL_BATCH_MAX", "100"))
+# 成功响应的缓存头：客户端/CDN 在 max-age 内直接复用，之后 stale-while-revalidate 秒内先用旧结果再带 If-None-Match 重新验证
+CACHE_CONTROL = os.getenv("BQXS520_CACHE_CONTROL", "public, max-age=60, stale-while-revalidate=600")
+# 移动端和桌面端页面解析结果不同
+VARY_HEADERS = {"Vary": "User-Agent"}
+
+# 搜索/详情结果缓存，移动端和桌面端页面不同，所以键里带上 User-Agent 类别
+# CACHE_BACKEND=sqlite 时多个 worker 共享，见 api/common/cache.py
+search_cache = create_cache(
+    "bqxs520_search",
+    max_entries=int(os.getenv("BQXS520_SEARCH_CACHE_ENTRIES", "512")),
+    max_bytes=int(os.getenv("BQXS520_SEARCH_CACHE_BYTES", str(8 * 1024 * 1024))),
+    ttl=float(os.getenv("BQXS520_SEARCH_TTL", "300")),
+)
+detail_cache = create_cache(
+    "bqxs520_detail",
+    max_entries=int(os.getenv("BQXS520_DETAIL_CACHE_ENTRIES", "2048")),
+    max_bytes=int(os.getenv("BQXS520_DETAIL_CACHE_BYTES", str(16 * 1024 * 1024))),
+    ttl=float(os.getenv("BQXS520_DETAIL_TTL", "900")),
+)
+
+metrics.register_collector("bqxs520", lambda: [
+    *metrics.stats_samples("cache", search_cache.stats(), {"cache": "bqxs520_search"}),
+    *metrics.stats_samples("cache", detail_cache.stats(), {"cache": "bqxs520_detail"}),
+    *metrics.stats_samples("cache", dict(chapter_indexes.stats(), **chapter_stats), {"cache": "bqxs520_chapters"}),
+])
+
+_MOBILE_UA = re.compile(r"mobile|android|iphone|ipad|ipod", re.I)
+
+
+def _ua_class(user_agent: str) -> str:
+    return "mobile" if _MOBILE_UA.search(user_agent) else "desktop"
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.split())
+
+
+def _ok(request: Request, content: dict):
+    with phase("serialize"):
+        return revalidating_json(request, content, CACHE_CONTROL, VARY_HEADERS)
+
+
+def _error(content: dict):
+    # 错误结果不缓存，下次请求重新访问上游
+    return FastJSONResponse(content=content, headers={"Cache-Control": "no-store"})
+
 
 # 搜索功能
 @router.get("/search")
-async def search(query: str, request: Request):
+async def search(
+    query: str,
+    request: Request,
+    stream: bool = Query(False, description="为true时以NDJSON逐条流式返回搜索结果"),
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
     headers = {
         "User-Agent": request.headers.get("User-Agent", "Mobile")
     }
@@ -23,280 +89,301 @@ async def search(query: str, request: Request):
 
     参数:
     - query: 搜索关键词字符串
+    - stream: 为true时边下载边解析，每解析出一本书就输出一行JSON（application/x-ndjson）
 
     返回:
-    - JSONResponse: 包含搜索状态码、消息以及搜索到的书籍相关信息列表的JSON响应
+    - JSONResponse: 包含搜索状态码、消息以及搜索到的书籍相关信息列表的JSON响应，带 ETag，If-None-Match 命中时返回 304
+    - StreamingResponse（stream=true）: 每行一条书籍信息；上游请求失败时与非流式一样返回错误 JSON，
+      开始输出后才中断时输出一行 {"c": "500", "m": ...}
     """
+    query = _normalize_query(query)
     if not query:
-        return JSONResponse(content={"c": "400", "m": "请输入搜索关键词", "data": []})
-
-    async with httpx.AsyncClient() as client:
-        encoded_query = quote(query)
-        search_url = f"https://www.bqxs520.com/search.shtml?key={encoded_query}"
-        response = await client.get(search_url, headers=headers)
-
-        if response.status_code!= 200:
-            return JSONResponse(content={"c": "500", "m": "请求失败", "data": []})
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-        entries = soup.select("dd ul li")
-        results = []
-
-        for entry in entries:
-            title = entry.find('span').get('title') if entry.find('span') else None
-            href = entry.find('a').get('href') if entry.find('a') else None
-            src = entry.find('img').get('src') if entry.find('img') else 'https://s2.loli.net/2024/11/10/RFcln7Wz2Y145VZ.jpg'
-
-            desc_div = entry.select_one(".desc")
-            desc_text = desc_div.get_text(strip=True) if desc_div else '暂无简介'
-
-            # 提取ID
-            id_match = re.search(r'/book/(\d+)_(\d+)_(\d+)\.shtml', href)
-            if id_match:
-                id1, id2, id3 = id_match.groups()
-                book_id = f"{id1}_{id2}_{id3}"
-            else:
-                id1 = id2 = id3 = book_id = None
-
-            # 使用CSS选择器提取标签
-            itags = []
-            tag_spans = entry.select('.tags > span > a')
-            for tag_span in tag_spans:
-                itags.append(tag_span.text)
-
-            results.append({
-                "book_name": title,
-                "img": src,
-                "text": desc_text,
-                "itag": ", ".join(itags),
-                "id": {
-                    "id1": id1,
-                    "id2": id2,
-                    "id3": id3,
-                    "book_id": book_id
-                },
-                "url": href
-            })
-
-        return JSONResponse(content={"c": "200", "m": "成功响应", "data": results})
+        return _error({"c": "400", "m": "请输入搜索关键词", "data": []})
+
+    cache_key = (query.casefold(), _ua_class(headers["User-Agent"]))
+    encoded_query = quote(query)
+    search_url = f"{BQXS520_BASE_URL}/search.shtml?key={encoded_query}"
+    cached = await search_cache.aget(cache_key)
+    if cached is not None:
+        if stream:
+            return StreamingResponse(_stream_cached(cached), media_type="application/x-ndjson")
+        return _ok(request, {"c": "200", "m": "成功响应", "data": cached})
+
+    if stream:
+        # 先拿到上游响应头并检查状态码，失败时与非流式一样返回错误，而不是 200 里夹一行错误
+        try:
+            with phase("upstream"):
+                response = await client.send(
+                    client.build_request("GET", search_url, headers=headers, timeout=10), stream=True
+                )
+        except httpx.HTTPError as e:
+            logger.error(f"流式搜索请求出错: {search_url}: {e}")
+            return _error({"c": "500", "m": "请求失败", "data": []})
+        if response.status_code != 200:
+            await response.aclose()
+            logger.error(f"流式搜索请求失败: {search_url} 返回 {response.status_code}")
+            return _error({"c": "500", "m": "请求失败", "data": []})
+        return StreamingResponse(
+            _stream_search(response, cache_key),
+            media_type="application/x-ndjson",
+            # 客户端在开始读取前断开时生成器不会运行，由这里关闭上游响应
+            background=BackgroundTask(response.aclose),
+        )
+
+    try:
+        with phase("upstream"):
+            response = await client.get(search_url, headers=headers, timeout=10)
+    except httpx.HTTPError as e:
+        logger.error(f"搜索请求出错: {search_url}: {e}")
+        return _error({"c": "500", "m": "请求失败", "data": []})
+
+    if response.status_code!= 200:
+        logger.error(f"搜索请求失败: {search_url} 返回 {response.status_code}")
+        return _error({"c": "500", "m": "请求失败", "data": []})
+
+    with phase("parse"):
+        results = await run_parser(parse_search, response.text)
+
+    await search_cache.aset(cache_key, results)
+    return _ok(request, {"c": "200", "m": "成功响应", "data": results})
+
+
+def _ndjson_line(obj) -> bytes:
+    return dumps(obj) + b"\n"
+
+
+async def _stream_cached(results):
+    for entry in results:
+        yield _ndjson_line(entry)
+
+
+async def _stream_search(response: httpx.Response, cache_key):
+    """逐块解析已经打开的上游响应，解析在线程里执行，不占用事件循环"""
+    parser = SearchStreamParser()
+    results = []
+    try:
+        async for chunk in response.aiter_text():
+            for entry in await run_incremental(parser.feed, chunk):
+                results.append(entry)
+                yield _ndjson_line(entry)
+    except httpx.HTTPError as e:
+        # 响应头已经发出，只能用一行错误信息告诉客户端结果不完整
+        logger.error(f"流式搜索请求出错: {e}")
+        yield _ndjson_line({"c": "500", "m": "请求失败"})
+        return
+    finally:
+        await response.aclose()
+
+    for entry in await run_incremental(parser.close):
+        results.append(entry)
+        yield _ndjson_line(entry)
+    await search_cache.aset(cache_key, results)
+
+
+class DetailError(Exception):
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def _normalize_book_id(book_id: str) -> str:
+    # 判断传入的book_id是否为完整链接，如果是则提取其中的书籍ID部分
+    match = re.match(r'.*bqxs520.com/book/(.*)\.shtml', book_id)
+    if match:
+        book_id = match.group(1)
+    return book_id.strip()
+
+
+async def fetch_detail(client: httpx.AsyncClient, book_id: str, headers: dict, fanout: bool = False) -> dict:
+    """
+    获取并解析一本书的详情（优先读缓存）。
+
+    fanout 为 True（批量接口）时，向上游请求期间占用该主机的并发信号量；缓存命中不占用。
+
+    失败时抛出 DetailError，code/message 与接口返回的 c/m 字段一致。
+    """
+    id_parts = book_id.split('_')
+    if len(id_parts) != 3:
+        raise DetailError("400", "请输入书籍ID或有效链接")
+
+    cache_key = (book_id, _ua_class(headers["User-Agent"]))
+    cached = await detail_cache.aget(cache_key)
+    if cached is not None:
+        return cached
+
+    detail_url = f"{BQXS520_BASE_URL}/book/{book_id}.shtml"
+    try:
+        with phase("upstream"):
+            async with host_semaphore(detail_url) if fanout else contextlib.nullcontext():
+                response = await client.get(detail_url, headers=headers, timeout=10, follow_redirects=True)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.error(f"请求发生错误: {e}")
+        raise DetailError("500", "请求失败")
+
+    try:
+        with phase("parse"):
+            parsed = await run_parser(parse_detail, response.text)
+    except ParseError as e:
+        logger.error(f"解析详情页出错: {e}")
+        raise DetailError("500", "解析详情页失败")
+
+    detail_results = {
+        "id": {
+            "id1": id_parts[0],
+            "id2": id_parts[1],
+            "id3": id_parts[2],
+            "book_id": book_id
+        },
+        **parsed
+    }
+    await detail_cache.aset(cache_key, detail_results)
+    return detail_results
 
 
 # 书籍详情页功能
 @router.get("/detail")
-async def detail(request: Request, book_id: str = Query(..., description="书籍ID")):
+async def detail(
+    request: Request,
+    book_id: str = Query(..., description="书籍ID"),
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
     headers = {
         "User-Agent": request.headers.get("User-Agent", "Mobile")
     }
     """
-    根据输入的书籍ID或完整书籍详情页链接获取对应书籍的详细信息，包括书名、作者、更新时间等内容，同时提取第一个章节的id作为list_id返回，优先使用XPath获取主角信息，失败则用CSS选择器尝试获取。
+    根据输入的书籍ID或完整书籍详情页链接获取对应书籍的详细信息，包括书名、作者、更新时间等内容，同时提取第一个章节的id作为list_id返回。页面解析见 api/bqxs520_parser.py。
 
     参数:
     - request: 用于获取客户端请求相关信息的Request对象，从中获取请求头
     - book_id: 从请求参数中获取的书籍ID字符串（通过Query获取，设置为必传参数），也支持直接传入完整链接
 
     返回:
-    - JSONResponse: 包含获取详情状态码、消息以及书籍详细信息和以第一个章节id作为list_id的JSON响应
+    - JSONResponse: 包含获取详情状态码、消息以及书籍详细信息和以第一个章节id作为list_id的JSON响应，带 ETag，If-None-Match 命中时返回 304
     """
-    # 判断传入的book_id是否为完整链接，如果是则提取其中的书籍ID部分
-    match = re.match(r'.*bqxs520.com/book/(.*)\.shtml', book_id)
-    if match:
-        book_id = match.group(1)
-
+    book_id = _normalize_book_id(book_id)
     if not book_id:
-        return JSONResponse(content={"c": "400", "m": "请输入书籍ID或有效链接", "data": {}})
+        return _error({"c": "400", "m": "请输入书籍ID或有效链接", "data": {}})
+
+    try:
+        detail_results = await fetch_detail(client, book_id, headers)
+    except DetailError as e:
+        return _error({"c": e.code, "m": e.message, "data": {}})
+    return _ok(request, {"c": "200", "m": "成功响应", "data": detail_results})
+
+
+class DetailBatchArgs(pydantic.BaseModel):
+    book_ids: typing.List[str]
 
-    async with httpx.AsyncClient() as client:
-        detail_url = f"https://www.bqxs520.com/book/{book_id}.shtml"
-        try:
-            response = await client.get(detail_url, headers=headers, timeout=10, follow_redirects=True)
-            response.raise_for_status()
-
-            content = response.text
-            root = etree.HTML(content)
-
-            # 提取书籍详情信息
-            try:
-                bookname = root.xpath("string(//h1/span/text())")
-                if bookname is None or bookname.strip() == "":
-                    bookname = None
-            except Exception as e:
-                print(f"提取书名信息失败: {e}")
-                bookname = None
-
-            try:
-                author = root.xpath("string(//div[@class='title']/span/a/text())")
-                if author is None or author.strip() == "":
-                    author = None
-            except Exception as e:
-                print(f"提取作者信息失败: {e}")
-                author = None
-
-            try:
-                update_time = root.xpath("string(//p[3]/text())")
-                update_time = update_time.strip() if update_time else None
-            except Exception as e:
-                print(f"提取更新时间信息失败: {e}")
-                update_time = None
-
-            try:
-                lastest_chapter_name = root.xpath("string(//p[4]/text())")
-                if lastest_chapter_name is None or lastest_chapter_name.strip() == "":
-                    lastest_chapter_name = None
-            except Exception as e:
-                print(f"提取最新章节名信息失败: {e}")
-                lastest_chapter_name = None
-
-            # 提取描述
-            try:
-                description_p5 = root.xpath("string(//p[5])")
-                description_p5 = description_p5.strip() if description_p5 else ""
-            except Exception as e:
-                print(f"提取描述信息（p5部分）失败: {e}")
-                description_p5 = ""
-
-            try:
-                description_p6 = root.xpath("string(//p[6])")
-                description_p6 = description_p6.strip() if description_p6 else ""
-            except Exception as e:
-                print(f"提取描述信息（p6部分）失败: {e}")
-                description_p6 = ""
-
-            description = f"{description_p5}\n{description_p6}"
-            if description == "\n":
-                description = ""
-
-            # 提取图片链接
-            try:
-                img = root.xpath("string(//img/@src)")
-                if img is None or img.strip() == "":
-                    img = None
-            except Exception as e:
-                print(f"提取图片链接信息失败: {e}")
-                img = None
-
-            # 提取属性
-            property_dict = {}
-            try:
-                property_dict['book_name'] = root.xpath("string(//meta[@property='og:novel:book_name']/@content)")
-                if property_dict['book_name'] is None or property_dict['book_name'].strip() == "":
-                    property_dict['book_name'] = None
-            except Exception as e:
-                print(f"提取属性（book_name）信息失败: {e}")
-                property_dict['book_name'] = None
-
-            try:
-                property_dict['author'] = root.xpath("string(//meta[@property='og:novel:author']/@content)")
-                if property_dict['author'] is None or property_dict['author'].strip() == "":
-                    property_dict['author'] = None
-            except Exception as e:
-                print(f"提取属性（author）信息失败: {e}")
-                property_dict['author'] = None
-
-            try:
-                property_dict['description'] = root.xpath("string(//meta[@property='og:description']/@content)")
-                if property_dict['description'] is None or property_dict['description'].strip() == "":
-                    property_dict['description'] = None
-            except Exception as e:
-                print(f"提取属性（description）信息失败: {e}")
-                property_dict['description'] = None
-
-            try:
-                property_dict['category'] = root.xpath("string(//meta[@property='og:novel:category']/@content)")
-                if property_dict['category'] is None or property_dict['category'].strip() == "":
-                    property_dict['category'] = None
-            except Exception as e:
-                print(f"提取属性（category）信息失败: {e}")
-                property_dict['category'] = None
-
-            try:
-                property_dict['status'] = root.xpath("string(//meta[@property='og:novel:status']/@content)")
-                if property_dict['status'] is None or property_dict['status'].strip() == "":
-                    property_dict['status'] = None
-            except Exception as e:
-                print(f"提取属性（status）信息失败: {e}")
-                property_dict['status'] = None
-
-            try:
-                property_dict['lastest_chapter_name'] = root.xpath("string(//meta[@property='og:novel:lastest_chapter_name']/@content)")
-                if property_dict['lastest_chapter_name'] is None or property_dict['lastest_chapter_name'].strip() == "":
-                    property_dict['lastest_chapter_name'] = None
-            except Exception as e:
-                print(f"提取属性（lastest_chapter_name）信息失败: {e}")
-                property_dict['lastest_chapter_name'] = None
-
-            try:
-                property_dict['update_time'] = root.xpath("string(//meta[@property='og:novel:update_time']/@content)")
-                if property_dict['update_time'] is None or property_dict['update_time'].strip() == "":
-                    property_dict['update_time'] = None
-            except Exception as e:
-                print(f"提取属性（update_time）信息失败: {e}")
-                property_dict['update_time'] = None
-
-            # 提取标签
-            try:
-                itags = root.xpath("//p[@class='itag']/a/text()")
-                itags = [tag.strip() for tag in itags] if itags else []
-            except Exception as e:
-                print(f"提取标签信息失败: {e}")
-                itags = []
-
-            # 提取主角，先尝试用XPath，失败则用CSS选择器
-            protagonists = []
-            try:
-                protagonists_elements = root.xpath("//div[@class='info']/p[1]/span")
-                if protagonists_elements:
-                    for element in protagonists_elements:
-                        text = "".join(element.itertext()).strip() if element.itertext() else ""
-                        # 去除多余空白字符、换行等，确保文本规范
-                        clean_text = " ".join(text.split())
-                        if clean_text:
-                            protagonists.append(clean_text)
-            except etree.XPathEvalError as e:
-                print(f"使用XPath提取主角信息失败，尝试使用CSS选择器，错误信息: {e}")
-                soup = BeautifulSoup(content, 'html.parser')
-                protagonists_span = soup.select('p:nth-child(3) > span:nth-child(n+1)')
-                if protagonists_span:
-                    for span in protagonists_span:
-                        text = span.get_text(strip=True) if span.get_text(strip=True) else ""
-                        # 同样进行文本规范处理
-                        clean_text = " ".join(text.split())
-                        if clean_text:
-                            protagonists.append(clean_text)
-
-            # 提取第一个章节的id
-            chapter_links = root.xpath('//div[@class="chapterlist"]/a')
-            first_chapter_id = ""
-            if chapter_links:
-                first_link = chapter_links[0]
-                onclick_attr = first_link.get('onclick')
-                if onclick_attr:
-                    match = re.search(r'read\((\d+)\)', onclick_attr)
-                    if match:
-                        first_chapter_id = match.group(1)
-
-            detail_results = {
-                "id": {
-                    "id1": book_id.split('_')[0],
-                    "id2": book_id.split('_')[1],
-                    "id3": book_id.split('_')[2],
-                    "book_id": book_id
-                },
-                'bookname': bookname,
-                'author': author,
-                'update_time': update_time,
-                'lastest_chapter_name': lastest_chapter_name,
-                'description': description,
-                'img': img,
-                'property': property_dict,
-                'itag': ", ".join(itags),
-                'protagonist': ", ".join(protagonists),
-                "list_id": first_chapter_id
-            }
-            return JSONResponse(content={"c": "200", "m": "成功响应", "data": detail_results})
-        except httpx.RequestError as e:
-            print(f"请求发生错误: {e}")
-            return JSONResponse(content={"c": "500", "m": "请求失败", "data": {}})
-        except etree.XPathEvalError as e:
-            print(f"XPath表达式解析出错（非主角提取部分）: {e}")
-            return JSONResponse(content={"c": "500", "m": "解析详情页失败", "data": {}})
 
+@router.post("/detail/batch")
+async def detail_batch(
+    args: DetailBatchArgs,
+    request: Request,
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
+    """
+    批量获取书籍详情，用于书架等一次需要几十本书详情的页面。
+
+    参数:
+    - args.book_ids: 书籍ID或完整书籍详情页链接的列表
+
+    返回:
+    - JSONResponse: data 为 {书籍ID: 详情}；获取失败的书籍放在 errors 中，格式为 {书籍ID: {"c": 状态码, "m": 消息}}
+    """
+    headers = {
+        "User-Agent": request.headers.get("User-Agent", "Mobile")
+    }
+    if len(args.book_ids) > DETAIL_BATCH_MAX:
+        return _error({"c": "400", "m": f"一次最多查询{DETAIL_BATCH_MAX}本书", "data": {}, "errors": {}})
+
+    data = {}
+    errors = {}
+    book_ids = []
+    for raw_id in args.book_ids:
+        book_id = _normalize_book_id(raw_id)
+        if not book_id:
+            errors[raw_id] = {"c": "400", "m": "请输入书籍ID或有效链接"}
+        elif book_id not in book_ids:
+            book_ids.append(book_id)
+
+    # 同一上游主机的并发数受信号量限制，缓存命中的书不用排队
+    results = await asyncio.gather(
+        *(fetch_detail(client, book_id, headers, fanout=True) for book_id in book_ids),
+        return_exceptions=True,
+    )
+    for book_id, result in zip(book_ids, results):
+        if isinstance(result, DetailError):
+            errors[book_id] = {"c": result.code, "m": result.message}
+        elif isinstance(result, Exception):
+            logger.error(f"获取详情出错 {book_id}: {result}", exc_info=result)
+            errors[book_id] = {"c": "500", "m": "获取详情失败"}
+        else:
+            data[book_id] = result
+
+    # 部分失败的结果不缓存，客户端下次重试时能拿到完整结果
+    if errors:
+        return _error({"c": "200", "m": "成功响应", "data": data, "errors": errors})
+    return _ok(request, {"c": "200", "m": "成功响应", "data": data, "errors": errors})
+
+
+@router.get("/chapters")
+async def chapters(
+    request: Request,
+    book_id: str = Query(..., description="书籍ID"),
+    offset: int = Query(0, ge=0, description="从第几章开始（从 0 开始计数）"),
+    limit: int = Query(100, ge=1, le=1000, description="最多返回多少章"),
+    after: typing.Optional[str] = Query(None, description="章节ID，返回该章之后的章节，优先于 offset"),
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
+    """
+    分页获取书籍的完整章节目录。目录按书缓存，过期后增量刷新，见 api/bqxs520_chapters.py。
+
+    参数:
+    - book_id: 书籍ID，也支持直接传入完整链接
+    - offset / limit: 按位置分页
+    - after: 章节ID（即 list_id 或上一页最后一章的 id），返回其后的 limit 章，用于阅读端翻章
+
+    返回:
+    - JSONResponse: data 为 {"book_id", "total", "lastest_chapter_name", "offset", "chapters": [{"id", "title"}, ...]}，
+      带 ETag，If-None-Match 命中时返回 304
+    """
+    headers = {
+        "User-Agent": request.headers.get("User-Agent", "Mobile")
+    }
+    book_id = _normalize_book_id(book_id)
+    if len(book_id.split('_')) != 3:
+        return _error({"c": "400", "m": "请输入书籍ID或有效链接", "data": {}})
+
+    try:
+        index = await get_chapter_index(
+            client, book_id, _ua_class(headers["User-Agent"]), f"{BQXS520_BASE_URL}/book/{book_id}.shtml", headers
+        )
+    except ChapterFetchError as e:
+        logger.error(f"获取章节目录失败: {e}")
+        return _error({"c": "500", "m": "获取章节目录失败", "data": {}})
+
+    if after is not None:
+        try:
+            offset = index.position(int(after)) + 1
+        except ValueError:
+            return _error({"c": "404", "m": "章节不存在", "data": {}})
+
+    return _ok(request, {"c": "200", "m": "成功响应", "data": {
+        "book_id": book_id,
+        "total": len(index),
+        "lastest_chapter_name": index.latest_chapter_name,
+        "offset": offset,
+        "chapters": index.slice(offset, limit),
+    }})
+
+
+@router.get("/cache")
+async def cache_stats():
+    """搜索、详情和章节目录缓存的命中统计"""
+    return {
+        "search": search_cache.stats(),
+        "detail": detail_cache.stats(),
+        "chapters": dict(chapter_indexes.stats(), **chapter_stats),
+    }
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+"""
+bqxs520 完整章节目录的索引。
+
+详情页接口只返回第一章的 list_id，阅读端翻章时不得不反复抓取、解析整个详情页。
+这里为每本书把目录解析一次，存成紧凑的数组索引：章节 ID 放在 array('q') 里，
+标题拼成一个字符串、用 array('I') 记录每个标题的结束位置，几千章的书也只占几十 KB，
+按 offset/limit 或「某章之后」取一段只是切片。
+
+移动端和桌面端的页面不同，索引按 (书籍ID, UA 类别) 分别缓存。
+
+索引过期后的刷新是增量的：
+- 下载到 </head> 时先读出 og:novel:lastest_chapter_name，与索引里的一致时直接断开，不再下载目录部分
+- 有新章节时，如果新目录以旧目录开头，只把多出来的章节追加到索引末尾；否则整体重建
+
+解析都在解析池（api/common/parse_pool.py）里执行，几千章的目录也不会卡住事件循环。
+
+可通过环境变量调整：
+- BQXS520_CHAPTERS_TTL: 索引在多少秒内直接使用、不向上游确认，默认 300
+- BQXS520_CHAPTERS_ENTRIES / BQXS520_CHAPTERS_BYTES: 最多缓存多少本书的目录（默认 1024）、总字节数（默认 32MB）
+"""
+import os
+import re
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+from api.bqxs520_parser import parse_chapter_list, parse_latest_chapter_name
+from api.common.cache import LRUCache, SingleFlight
+from api.common.metrics import phase
+from api.common.parse_pool import run_parser
+
+CHAPTERS_TTL = float(os.getenv("BQXS520_CHAPTERS_TTL", "300"))
+_HEAD_END = re.compile(r"</head\s*>", re.I)
+
+
+class ChapterIndex:
+    """一本书的章节目录：第 i 章的 ID 为 ids[i]，标题为 titles[ends[i-1]:ends[i]]"""
+
+    def __init__(self, latest_chapter_name: Optional[str] = None):
+        self.ids = array("q")
+        self.ends = array("I")
+        self.titles = ""
+        self.latest_chapter_name = latest_chapter_name
+        self.checked_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() - self.checked_at < CHAPTERS_TTL
+
+    def extend(self, chapters: Iterable[Tuple[int, str]]) -> None:
+        end = self.ends[-1] if self.ends else 0
+        titles = []
+        for chapter_id, title in chapters:
+            self.ids.append(chapter_id)
+            end += len(title)
+            self.ends.append(end)
+            titles.append(title)
+        self.titles += "".join(titles)
+
+    def is_prefix_of(self, chapters: List[Tuple[int, str]]) -> bool:
+        """新目录是否以当前目录开头（只比较首尾两章的 ID）"""
+        count = len(self.ids)
+        if count == 0 or len(chapters) < count:
+            return False
+        return chapters[0][0] == self.ids[0] and chapters[count - 1][0] == self.ids[-1]
+
+    def position(self, chapter_id: int) -> int:
+        """章节在目录中的下标，不存在时抛出 ValueError"""
+        return self.ids.index(chapter_id)
+
+    def slice(self, offset: int, limit: int) -> List[Dict[str, str]]:
+        chapters = []
+        for i in range(max(offset, 0), min(offset + limit, len(self.ids))):
+            start = self.ends[i - 1] if i else 0
+            chapters.append({"id": str(self.ids[i]), "title": self.titles[start:self.ends[i]]})
+        return chapters
+
+    def nbytes(self) -> int:
+        return len(self.ids) * (self.ids.itemsize + self.ends.itemsize) + len(self.titles.encode("utf-8")) + 128
+
+
+chapter_indexes = LRUCache(
+    max_entries=int(os.getenv("BQXS520_CHAPTERS_ENTRIES", "1024")),
+    max_bytes=int(os.getenv("BQXS520_CHAPTERS_BYTES", str(32 * 1024 * 1024))),
+    sizeof=lambda index: index.nbytes(),
+)
+_flight = SingleFlight()
+# fresh: TTL 内直接使用；unchanged: 最新章节没变，读完 <head> 就断开；appended: 增量追加；rebuilt: 整体重建
+chapter_stats = {"fresh": 0, "unchanged": 0, "appended": 0, "rebuilt": 0}
+
+
+class ChapterFetchError(Exception):
+    pass
+
+
+async def _refresh(client: httpx.AsyncClient, key: Tuple[str, str], detail_url: str, headers: dict) -> ChapterIndex:
+    current: Optional[ChapterIndex] = chapter_indexes.get(key)
+    # 只有已有索引时才需要提前比较最新章节
+    head_checked = current is None
+    parts: List[str] = []
+    try:
+        with phase("upstream"):
+            async with client.stream("GET", detail_url, headers=headers, timeout=10, follow_redirects=True) as response:
+                if response.status_code != 200:
+                    raise ChapterFetchError(f"{detail_url} 返回 {response.status_code}")
+                async for chunk in response.aiter_text():
+                    if head_checked:
+                        parts.append(chunk)
+                        continue
+                    # 标签可能被切在两个数据块之间，带上前一块的结尾一起查找
+                    window = (parts[-1][-16:] if parts else "") + chunk
+                    parts.append(chunk)
+                    if not _HEAD_END.search(window):
+                        continue
+                    head_checked = True
+                    with phase("parse"):
+                        latest_chapter_name = await run_parser(parse_latest_chapter_name, "".join(parts))
+                    if latest_chapter_name and latest_chapter_name == current.latest_chapter_name:
+                        # 没有新章节，剩下的目录不用再下载
+                        current.checked_at = time.monotonic()
+                        chapter_stats["unchanged"] += 1
+                        return current
+    except httpx.HTTPError as e:
+        raise ChapterFetchError(str(e)) from e
+
+    with phase("parse"):
+        latest_chapter_name, chapters = await run_parser(parse_chapter_list, "".join(parts))
+    if not chapters:
+        raise ChapterFetchError(f"{detail_url} 没有解析到章节目录")
+
+    if current is not None and current.is_prefix_of(chapters):
+        # 切片都在事件循环里同步完成，直接在原索引上追加不会被读到一半
+        index = current
+        index.extend(chapters[len(current):])
+        index.latest_chapter_name = latest_chapter_name
+        index.checked_at = time.monotonic()
+        chapter_stats["appended"] += 1
+    else:
+        index = ChapterIndex(latest_chapter_name)
+        index.extend(chapters)
+        chapter_stats["rebuilt"] += 1
+    # 重新登记一次，LRU 按追加后的大小计算
+    chapter_indexes.set(key, index)
+    return index
+
+
+async def get_chapter_index(
+    client: httpx.AsyncClient,
+    book_id: str,
+    ua_class: str,
+    detail_url: str,
+    headers: dict,
+) -> ChapterIndex:
+    """
+    返回一本书在该 UA 类别（mobile / desktop）下的章节索引，过期时增量刷新；
+    同一本书的并发刷新合并成一次上游请求。
+
+    刷新失败时抛出 ChapterFetchError。
+    """
+    key = (book_id, ua_class)
+    index: Optional[ChapterIndex] = chapter_indexes.get(key)
+    if index is not None and index.fresh:
+        chapter_stats["fresh"] += 1
+        return index
+    return await _flight.do(key, lambda: _refresh(client, key, detail_url, headers))
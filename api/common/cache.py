@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+"""
+缓存工具。
+
+- SingleFlight: 相同 key 的并发加载合并成一次上游调用
+- key_hash: 把 API Key / token 转成可以放进缓存键和日志的短哈希
+- StaleWhileRevalidateCache: 带 TTL 的缓存，过期后先返回旧值，再由一个后台任务刷新
+- CacheBackend: 缓存后端接口（get / set / pop / clear / stats），由 create_cache() 按配置创建；
+  async 代码里用 aget / aset / apop，sqlite 后端在线程池里执行，不阻塞事件循环
+- LRUCache: 进程内后端，按条目数和字节数双重限制的 LRU 缓存，条目带 TTL，并统计命中率
+- SQLiteCache（api/common/sqlite_cache.py）: 同一台机器上多个 worker 进程共享的后端
+- DiskCache: 按总字节数限制的磁盘 LRU 缓存，值为 bytes
+
+可通过环境变量调整：
+- CACHE_BACKEND: memory（默认，每个进程各自一份）或 sqlite（多个 uvicorn worker 共享一份热数据）
+- CACHE_SQLITE_PATH: sqlite 后端的数据库文件，默认在系统临时目录下的 api-cache.sqlite3
+
+sqlite 后端的值要能编码成 JSON（或者是 bytes），键会转换成字符串。
+"""
+import abc
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "api-cache.sqlite3"))
+
+Loader = Callable[[], Awaitable[Any]]
+
+
+def key_hash(api_key: str) -> str:
+    """缓存、日志里只出现 API Key 的哈希"""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+class SingleFlight:
+    """
+    合并同一 key 的并发调用：第一个调用者真正执行 loader，其余调用者等待同一个结果。
+
+    loader 运行在独立的 Task 里，发起者被取消（比如客户端断开）不会连带取消其他等待者。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: Hashable, loader: Loader) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+
+            def done(t: asyncio.Task):
+                self._inflight.pop(key, None)
+                # 所有等待者都被取消时，避免出现 "Task exception was never retrieved"
+                if not t.cancelled():
+                    t.exception()
+
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+
+class StaleWhileRevalidateCache:
+    """
+    TTL 缓存，支持 stale-while-revalidate。
+
+    - 条目年龄 < ttl：直接返回
+    - ttl <= 年龄 < ttl + stale_ttl：返回旧值，同时在后台刷新（同一 key 只有一个刷新任务）
+    - 其他情况：同步加载，并发的未命中合并成一次上游请求
+
+    条目存放在 store 里（默认进程内 LRUCache），传入 create_cache() 的结果即可在多个进程间共享；
+    写入时间用墙上时间，不同进程写入的条目也能正确计算年龄。
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float = 0, store: Optional["CacheBackend"] = None):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        # key -> [value, 写入时间]
+        self._store = store if store is not None else LRUCache(ttl=ttl + stale_ttl)
+        self._flight = SingleFlight()
+        self._background: Set[asyncio.Task] = set()
+
+    async def get(self, key: Hashable, loader: Loader) -> Any:
+        entry = await self._store.aget(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            if age < self.ttl:
+                self.hits += 1
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._revalidate(key, loader)
+                return value
+
+        self.misses += 1
+        return await self._flight.do(key, lambda: self._load(key, loader))
+
+    async def invalidate(self, key: Hashable) -> None:
+        await self._store.apop(key)
+
+    async def _load(self, key: Hashable, loader: Loader) -> Any:
+        value = await loader()
+        await self._store.aset(key, [value, time.time()], ttl=self.ttl + self.stale_ttl)
+        return value
+
+    def _revalidate(self, key: Hashable, loader: Loader) -> None:
+        if key in self._flight:
+            return
+
+        async def refresh():
+            try:
+                await self._flight.do(key, lambda: self._load(key, loader))
+            except Exception as e:
+                logger.warning(f"后台刷新缓存失败 {key!r}: {e}")
+
+        task = asyncio.ensure_future(refresh())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+
+def estimate_size(value: Any) -> int:
+    """估算缓存值占用的字节数：bytes/str 取长度，其余按 JSON 编码后的长度计算"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return len(json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8"))
+
+
+class CacheBackend(abc.ABC):
+    """
+    缓存后端接口，调用方只依赖这几个方法，不关心数据放在进程内还是共享存储里。
+
+    get / set / pop 是同步的；共享后端会读写磁盘，async 代码应使用 aget / aset / apop，
+    默认放到线程池里执行。进程内的 LRUCache 直接同步完成，不切换线程。
+    """
+
+    @abc.abstractmethod
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        ...
+
+    @abc.abstractmethod
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        """写入缓存，ttl 为 None 时使用后端的默认 TTL；值太大不缓存时返回 False"""
+
+    @abc.abstractmethod
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        ...
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        ...
+
+    @abc.abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        ...
+
+    async def aget(self, key: Hashable, default: Any = None) -> Any:
+        return await run_in_threadpool(self.get, key, default)
+
+    async def aset(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        return await run_in_threadpool(self.set, key, value, ttl)
+
+    async def apop(self, key: Hashable, default: Any = None) -> Any:
+        return await run_in_threadpool(self.pop, key, default)
+
+
+def create_cache(
+    namespace: str,
+    max_entries: int = 1024,
+    max_bytes: int = 16 * 1024 * 1024,
+    ttl: Optional[float] = None,
+) -> CacheBackend:
+    """
+    按 CACHE_BACKEND 创建缓存后端。namespace 用来在共享存储里区分不同用途的缓存，
+    条目数和字节数限制按 namespace 分别计算。
+    """
+    if CACHE_BACKEND == "sqlite":
+        from api.common.sqlite_cache import SQLiteCache
+
+        return SQLiteCache(CACHE_SQLITE_PATH, namespace, max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+    if CACHE_BACKEND != "memory":
+        logger.warning(f"未知的 CACHE_BACKEND={CACHE_BACKEND!r}，使用进程内缓存")
+    return LRUCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+
+
+class LRUCache(CacheBackend):
+    """
+    有界 LRU 缓存。
+
+    同时受 max_entries（条目数）和 max_bytes（估算字节数）限制，超出时淘汰最久未使用的条目；
+    每个条目有自己的过期时间，过期条目在读取时惰性删除。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 16 * 1024 * 1024,
+        ttl: Optional[float] = None,
+        sizeof: Callable[[Any], int] = estimate_size,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        # key -> (value, size, expires_at)
+        self._data: "OrderedDict[Hashable, Tuple[Any, int, Optional[float]]]" = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and not self._expired(entry)
+
+    @staticmethod
+    def _expired(entry: Tuple[Any, int, Optional[float]]) -> bool:
+        expires_at = entry[2]
+        return expires_at is not None and expires_at <= time.monotonic()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if self._expired(entry):
+            self._remove(key)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        """写入缓存；单个值超过 max_bytes 时不缓存并返回 False"""
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return False
+        if key in self._data:
+            self._remove(key)
+
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (value, size, expires_at)
+        self.current_bytes += size
+
+        while len(self._data) > self.max_entries or self.current_bytes > self.max_bytes:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+        return True
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self._data:
+            return default
+        return self._remove(key)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.current_bytes = 0
+
+    # 纯内存操作，不值得切换到线程池
+    async def aget(self, key: Hashable, default: Any = None) -> Any:
+        return self.get(key, default)
+
+    async def aset(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        return self.set(key, value, ttl)
+
+    async def apop(self, key: Hashable, default: Any = None) -> Any:
+        return self.pop(key, default)
+
+    def _remove(self, key: Hashable) -> Any:
+        value, size, _ = self._data.pop(key)
+        self.current_bytes -= size
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.current_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class DiskCache:
+    """
+    磁盘 LRU 缓存：每个 key 一个文件，按总字节数淘汰最久未读取的文件。
+
+    key 必须是可以直接当文件名的字符串（例如十六进制哈希）。
+    读写都是同步文件操作，在 async 代码里应放到线程池中调用；内部索引有锁保护。
+    进程重启后首次访问时从目录重建索引（按 mtime 排序）。
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._index: "Optional[OrderedDict[str, int]]" = None
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _ensure_index(self) -> "OrderedDict[str, int]":
+        if self._index is None:
+            entries = []
+            for dirpath, _, filenames in os.walk(self.directory):
+                for name in filenames:
+                    if name.endswith(".tmp"):
+                        continue
+                    try:
+                        st = os.stat(os.path.join(dirpath, name))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, name, st.st_size))
+            entries.sort()
+            self._index = OrderedDict((name, size) for _, name, size in entries)
+            self.current_bytes = sum(self._index.values())
+        return self._index
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            index = self._ensure_index()
+            if key not in index:
+                self.misses += 1
+                return None
+            index.move_to_end(key)
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._forget(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def set(self, key: str, data: bytes) -> bool:
+        if len(data) > self.max_bytes:
+            return False
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            index = self._ensure_index()
+            self._forget(key)
+            index[key] = len(data)
+            self.current_bytes += len(data)
+            victims = []
+            while self.current_bytes > self.max_bytes and len(index) > 1:
+                oldest, size = index.popitem(last=False)
+                self.current_bytes -= size
+                self.evictions += 1
+                victims.append(oldest)
+        for victim in victims:
+            try:
+                os.remove(self._path(victim))
+            except FileNotFoundError:
+                pass
+        return True
+
+    def _forget(self, key: str) -> None:
+        size = self._index.pop(key, None) if self._index is not None else None
+        if size is not None:
+            self.current_bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._index) if self._index is not None else None,
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
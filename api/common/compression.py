@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""
+响应压缩。
+
+- CompressionMiddleware: 按 Accept-Encoding 选择 br（装了 brotli 时）或 gzip 压缩响应体。
+  只压缩白名单里的内容类型、且不小于最小长度的响应；图片等本身已压缩的内容、已经带 Content-Encoding 的响应原样输出。
+  流式响应（NDJSON）每个数据块都会 flush，不影响逐条返回
+- StaticAsset: 固定内容（使用说明页、public/ 下的文件）在创建时压缩一次，之后按请求直接返回对应的版本，带 ETag，支持 304
+
+压缩后的响应内容与原始字节不同，已有的强 ETag 会改成弱 ETag（W/"..."），与 nginx 的做法一致。
+
+可通过环境变量调整：
+- COMPRESS_MIN_SIZE: 小于该字节数的响应不压缩，默认 1024
+- COMPRESS_TYPES: 逗号分隔的内容类型白名单，以 / 结尾的表示整类，默认 application/json,application/x-ndjson,text/html,text/plain,text/css,application/javascript,image/svg+xml
+- COMPRESS_GZIP_LEVEL: 动态压缩的 gzip 级别，默认 6
+- COMPRESS_BROTLI_QUALITY: 动态压缩的 brotli 质量，默认 5；StaticAsset 只压缩一次，总是用最高级别
+"""
+import gzip
+import os
+import zlib
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi.responses import Response
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+
+from api.common.responses import etag_for, etag_matches
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - 没装 brotli 时只提供 gzip
+    brotli = None
+
+MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+CONTENT_TYPES = tuple(
+    t.strip() for t in os.getenv(
+        "COMPRESS_TYPES",
+        "application/json,application/x-ndjson,text/html,text/plain,text/css,"
+        "application/javascript,image/svg+xml",
+    ).split(",") if t.strip()
+)
+GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+
+SUPPORTED = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """按 Accept-Encoding 的 q 值选择编码，q 相同时 br 优先；都不接受时返回 None"""
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            weights[name] = q
+    best, best_q = None, 0.0
+    for encoding in SUPPORTED:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def is_compressible(content_type: str, content_types: Iterable[str] = CONTENT_TYPES) -> bool:
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return any(media_type.startswith(t) if t.endswith("/") else media_type == t for t in content_types)
+
+
+def compress(data: bytes, encoding: str, best: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if best else BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=9 if best else GZIP_LEVEL, mtime=0)
+
+
+class _StreamCompressor:
+    """流式压缩，每个数据块之后 flush，保证客户端能立即解出已经发出的内容"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._gz = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            out = self._br.process(data)
+            return out + (self._br.finish() if final else self._br.flush())
+        out = self._gz.compress(data)
+        return out + self._gz.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def _weaken_etag(headers: MutableHeaders) -> None:
+    etag = headers.get("etag")
+    if etag and not etag.startswith("W/"):
+        headers["etag"] = "W/" + etag
+
+
+def _varies_on_encoding(headers: Headers) -> bool:
+    return "accept-encoding" in (v.strip().lower() for v in headers.get("vary", "").split(","))
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = MIN_SIZE, content_types: Iterable[str] = CONTENT_TYPES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.content_types = tuple(content_types)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        encoding = choose_encoding(request_headers.get("accept-encoding", ""))
+        start = None
+        # None: 还没收到第一个响应体；False: 原样输出；否则为压缩器
+        compressor = None
+
+        async def send_wrapper(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=list(start["headers"]))
+                start = dict(start, headers=headers.raw)
+                compressor = False
+                if start["status"] == 304:
+                    # 客户端缓存的是压缩后的版本（弱 ETag），304 里的 ETag 要和当时的 200 保持一致
+                    etag = headers.get("etag")
+                    if etag and not etag.startswith("W/") and f"W/{etag}" in request_headers.get("if-none-match", ""):
+                        _weaken_etag(headers)
+                        headers.add_vary_header("Accept-Encoding")
+                elif (
+                    start["status"] >= 200
+                    and start["status"] != 204
+                    and "content-encoding" not in headers
+                    # 已经自己按 Accept-Encoding 协商过的响应（StaticAsset）不再处理
+                    and not _varies_on_encoding(headers)
+                    and is_compressible(headers.get("content-type", ""), self.content_types)
+                ):
+                    # 是否压缩取决于请求头，缓存必须按 Accept-Encoding 区分
+                    headers.add_vary_header("Accept-Encoding")
+                    if encoding is not None and (more_body or len(body) >= self.minimum_size):
+                        compressor = _StreamCompressor(encoding)
+                        headers["content-encoding"] = encoding
+                        _weaken_etag(headers)
+                        if "content-length" in headers:
+                            del headers["content-length"]
+                        if not more_body:
+                            body = compressor.chunk(body, final=True)
+                            headers["content-length"] = str(len(body))
+                            await send(start)
+                            await send(dict(message, body=body))
+                            return
+                await send(start)
+
+            if compressor:
+                message = dict(message, body=compressor.chunk(body, final=not more_body))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class StaticAsset:
+    """
+    内容固定的响应，创建时就把所有支持的压缩版本准备好。
+
+    压缩后没有明显变小（例如 PNG）的版本不保留，对这类文件总是返回原始内容。
+    """
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str = "public, max-age=3600"):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        etag = etag_for(body)
+        # 编码 -> (响应体, ETag)；不同编码的内容不同，ETag 也不同
+        self.variants: Dict[Optional[str], Tuple[bytes, str]] = {None: (body, etag)}
+        if is_compressible(media_type):
+            for encoding in SUPPORTED:
+                compressed = compress(body, encoding, best=True)
+                if len(compressed) < len(body) * 0.9:
+                    self.variants[encoding] = (compressed, f'{etag[:-1]}-{encoding}"')
+
+    @classmethod
+    def from_file(cls, path: str, media_type: str, **kwargs) -> "StaticAsset":
+        with open(path, "rb") as f:
+            return cls(f.read(), media_type, **kwargs)
+
+    def response(self, request: Request) -> Response:
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+        if encoding not in self.variants:
+            encoding = None
+        body, etag = self.variants[encoding]
+        headers = {"ETag": etag, "Cache-Control": self.cache_control}
+        if len(self.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        if_none_match = request.headers.get("if-none-match")
+        if any(etag_matches(if_none_match, tag) for _, tag in self.variants.values()):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type=self.media_type, headers=headers)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+全局共享的 httpx 连接池。
+
+所有路由通过 `Depends(get_http_client)` 拿到同一个 AsyncClient，
+避免每个请求都重新做 DNS / TCP / TLS 握手。
+
+可通过环境变量调整：
+- HTTP_TIMEOUT: 默认总超时（秒），默认 15
+- HTTP_CONNECT_TIMEOUT: 连接超时（秒），默认 5
+- HTTP_MAX_CONNECTIONS_PER_HOST: 每个上游主机的最大连接数，默认 20
+- HTTP_MAX_KEEPALIVE_PER_HOST: 每个上游主机保持的空闲长连接数，默认 10
+- HTTP_KEEPALIVE_EXPIRY: 空闲长连接的保留时间（秒），默认 30
+- HTTP_CLIENT_HTTP2: 设为 1 启用 HTTP/2（需要安装 h2，即 httpx[http2]）
+- HTTP_FANOUT_PER_HOST: 批量接口对同一上游主机的最大并发请求数，默认 8
+- HTTP_MAX_HOSTS: 最多同时为多少个上游主机保留独立的连接池和熔断状态，超出时淘汰最久未使用的，默认 64
+
+连接池外面包了一层熔断、对冲请求和重试预算，见 api/common/resilience.py（HTTP_RESILIENCE=0 关闭）。
+"""
+import asyncio
+import logging
+import os
+import ssl
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+import httpx
+
+from api.common.resilience import RESILIENCE, ResilientTransport
+
+logger = logging.getLogger(__name__)
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+MAX_KEEPALIVE_PER_HOST = int(os.getenv("HTTP_MAX_KEEPALIVE_PER_HOST", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2 = os.getenv("HTTP_CLIENT_HTTP2", "0") == "1"
+FANOUT_PER_HOST = int(os.getenv("HTTP_FANOUT_PER_HOST", "8"))
+MAX_HOSTS = int(os.getenv("HTTP_MAX_HOSTS", "64"))
+# 被淘汰的连接池等待进行中的请求结束的最长时间（秒）和检查间隔
+RETIRE_GRACE = 600
+RETIRE_POLL = 1
+
+_client: Optional[httpx.AsyncClient] = None
+_host_semaphores: "OrderedDict[str, asyncio.Semaphore]" = OrderedDict()
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class PerHostTransport(httpx.AsyncBaseTransport):
+    """
+    按 (scheme, host, port) 分别维护连接池的传输层。
+
+    httpx 自带的 Limits 是整个客户端共用的，一个慢上游会占满所有连接；
+    这里为每个上游主机懒创建独立的 AsyncHTTPTransport，使 keep-alive 限制按主机生效。
+
+    所有主机共用一个 SSLContext（加载 CA 证书要几十毫秒，不能每个主机都做一次）；
+    主机数超过 max_hosts 时淘汰最久未使用的连接池，等它的连接都空闲后再关闭。
+    """
+
+    def __init__(self, limits: httpx.Limits, http2: bool = False, max_hosts: int = MAX_HOSTS):
+        self._limits = limits
+        self._http2 = http2
+        self._max_hosts = max_hosts
+        self._ssl_context: Optional[ssl.SSLContext] = None
+        self._transports: "OrderedDict[Tuple[bytes, bytes, Optional[int]], httpx.AsyncHTTPTransport]" = OrderedDict()
+        self._retiring: Set[asyncio.Task] = set()
+
+    def _transport_for(self, url: httpx.URL) -> httpx.AsyncHTTPTransport:
+        key = (url.raw_scheme, url.raw_host, url.port)
+        transport = self._transports.get(key)
+        if transport is not None:
+            self._transports.move_to_end(key)
+            return transport
+        if self._ssl_context is None:
+            self._ssl_context = httpx.create_ssl_context()
+        transport = httpx.AsyncHTTPTransport(limits=self._limits, http2=self._http2, verify=self._ssl_context)
+        self._transports[key] = transport
+        while len(self._transports) > self._max_hosts:
+            _, evicted = self._transports.popitem(last=False)
+            task = asyncio.ensure_future(self._retire(evicted))
+            self._retiring.add(task)
+            task.add_done_callback(self._retiring.discard)
+        return transport
+
+    @staticmethod
+    async def _retire(transport: httpx.AsyncHTTPTransport) -> None:
+        """被淘汰的连接池上可能还有进行中的请求（包括流式响应），等连接都空闲后再关闭"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + RETIRE_GRACE
+        try:
+            while loop.time() < deadline:
+                connections = list(getattr(transport._pool, "connections", []))
+                if all(connection.is_idle() or connection.is_closed() for connection in connections):
+                    break
+                await asyncio.sleep(RETIRE_POLL)
+        finally:
+            # 客户端关闭时取消等待，直接关闭
+            try:
+                await transport.aclose()
+            except Exception as e:
+                logger.warning(f"关闭连接池失败: {e}")
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._transport_for(request.url).handle_async_request(request)
+
+    async def aclose(self) -> None:
+        transports = list(self._transports.values())
+        self._transports.clear()
+        for task in list(self._retiring):
+            task.cancel()
+        await asyncio.gather(*self._retiring, return_exceptions=True)
+        for transport in transports:
+            await transport.aclose()
+
+    @property
+    def host_count(self) -> int:
+        return len(self._transports)
+
+    def stats(self) -> Dict[str, dict]:
+        """每个上游主机当前的连接数和其中空闲的连接数"""
+        result = {}
+        for (_, host, port), transport in list(self._transports.items()):
+            connections = list(getattr(transport._pool, "connections", []))
+            name = host.decode("ascii", errors="replace") + (f":{port}" if port else "")
+            result[name] = {
+                "connections": len(connections),
+                "idle": sum(1 for connection in connections if connection.is_idle()),
+            }
+        return result
+
+
+def create_client() -> httpx.AsyncClient:
+    """按当前配置创建一个新的共享客户端"""
+    http2 = HTTP2
+    if http2 and not _http2_available():
+        logger.warning("HTTP_CLIENT_HTTP2=1 但未安装 h2，回退到 HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=MAX_CONNECTIONS_PER_HOST,
+        max_keepalive_connections=MAX_KEEPALIVE_PER_HOST,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+    transport = PerHostTransport(limits, http2=http2)
+    if RESILIENCE:
+        transport = ResilientTransport(transport, max_hosts=MAX_HOSTS)
+    return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+
+async def startup() -> None:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_client()
+
+
+async def shutdown() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    FastAPI 依赖：返回全局共享的 AsyncClient。
+
+    Vercel 等 serverless 环境不一定触发 startup 事件，所以这里在首次使用时惰性创建。
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_client()
+    return _client
+
+
+def _transports():
+    if _client is None or _client.is_closed:
+        return None, None
+    transport = _client._transport
+    if isinstance(transport, ResilientTransport):
+        return transport, transport.inner
+    return None, transport
+
+
+def pool_stats() -> Dict[str, dict]:
+    _, pool = _transports()
+    if not isinstance(pool, PerHostTransport):
+        return {}
+    return pool.stats()
+
+
+def resilience_stats() -> Dict[str, dict]:
+    resilient, _ = _transports()
+    if resilient is None:
+        return {}
+    return resilient.stats()
+
+
+def host_semaphore(url: str) -> asyncio.Semaphore:
+    """
+    批量扇出时按上游主机限制并发的信号量。
+
+    用法: `async with host_semaphore(url): await client.get(url)`
+
+    与连接池一样最多保留 HTTP_MAX_HOSTS 个主机，超出时丢弃最久未使用、且没有被占用的信号量。
+    """
+    host = httpx.URL(url).host
+    semaphore = _host_semaphores.get(host)
+    if semaphore is not None:
+        _host_semaphores.move_to_end(host)
+        return semaphore
+    semaphore = _host_semaphores[host] = asyncio.Semaphore(FANOUT_PER_HOST)
+    if len(_host_semaphores) > MAX_HOSTS:
+        # 正在被占用的信号量不能丢，否则同一主机的并发会暂时超过限制
+        for name in [name for name, s in _host_semaphores.items() if s._value == FANOUT_PER_HOST]:
+            if len(_host_semaphores) <= MAX_HOSTS or name == host:
+                break
+            del _host_semaphores[name]
+    return semaphore
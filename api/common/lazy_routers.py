@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+按需加载的路由注册表。
+
+Vercel 上每次冷启动都会执行 main.py 的全部 import；如果启动时就导入所有路由模块，
+只访问 /hello 的请求也要为 lxml、openai、requests 等重量级依赖买单。
+这里先只登记「前缀 -> 模块:属性」，第一次收到该前缀下的请求时才导入模块并挂载路由。
+
+设置环境变量 LAZY_ROUTERS=0 可以在启动时一次性加载全部路由（适合常驻进程）。
+
+导入耗时报告（每个模块在全新的解释器里单独导入）:
+    python -m api.common.lazy_routers
+"""
+import importlib
+import logging
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from fastapi import FastAPI
+
+logger = logging.getLogger(__name__)
+
+LAZY_ROUTERS = os.getenv("LAZY_ROUTERS", "1") != "0"
+
+
+class LazyRouterRegistry:
+    def __init__(self, app: FastAPI):
+        self.app = app
+        self.targets: Dict[str, str] = {}
+        self._pending: Dict[str, str] = {}
+        # 前缀 -> 首次加载时 import + include_router 的耗时（秒）
+        self.load_times: Dict[str, float] = {}
+
+    def register(self, prefix: str, target: str) -> None:
+        """登记一个路由，target 形如 "api.bqxs520:router"，模块在首次访问 prefix 时才导入"""
+        self.targets[prefix] = target
+        self._pending[prefix] = target
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._pending)
+
+    def load(self, prefix: str) -> None:
+        target = self._pending.pop(prefix, None)
+        if target is None:
+            return
+        module_name, _, attr = target.partition(":")
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        self.app.include_router(getattr(module, attr or "router"), prefix=prefix)
+        # 新挂载的路由要出现在 /docs 里
+        self.app.openapi_schema = None
+        self.load_times[prefix] = time.perf_counter() - start
+        logger.info(f"加载路由 {prefix} ({target}) 耗时 {self.load_times[prefix] * 1000:.1f}ms")
+
+    def load_for_path(self, path: str) -> None:
+        for prefix in list(self._pending):
+            if path == prefix or path.startswith(prefix + "/"):
+                self.load(prefix)
+
+    def load_all(self) -> None:
+        for prefix in list(self._pending):
+            self.load(prefix)
+
+    def report(self) -> List[dict]:
+        return [
+            {
+                "prefix": prefix,
+                "target": target,
+                "loaded": prefix not in self._pending,
+                "load_ms": round(self.load_times[prefix] * 1000, 1) if prefix in self.load_times else None,
+            }
+            for prefix, target in self.targets.items()
+        ]
+
+
+class LazyRouterMiddleware:
+    """在请求进入路由匹配之前，按路径加载对应的路由模块；访问 OpenAPI 文档时加载全部"""
+
+    def __init__(self, app, registry: LazyRouterRegistry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket") and self.registry.pending:
+            path = scope["path"]
+            fastapi_app = self.registry.app
+            if path in (fastapi_app.openapi_url, fastapi_app.docs_url, fastapi_app.redoc_url):
+                self.registry.load_all()
+            else:
+                self.registry.load_for_path(path)
+        await self.app(scope, receive, send)
+
+
+_IMPORT_TIMER = (
+    "import time, importlib, fastapi, httpx\n"
+    "start = time.perf_counter()\n"
+    "importlib.import_module({module!r})\n"
+    "print(time.perf_counter() - start)\n"
+)
+
+
+def measure_import(module_name: str) -> float:
+    """在全新的解释器里导入模块，返回导入耗时（秒），不含 fastapi/httpx 本身"""
+    output = subprocess.check_output(
+        [sys.executable, "-c", _IMPORT_TIMER.format(module=module_name)],
+        cwd=os.getcwd(),
+    )
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def main() -> None:
+    from main import routers
+
+    rows = []
+    for prefix, target in routers.targets.items():
+        module_name = target.partition(":")[0]
+        rows.append((measure_import(module_name), prefix, module_name))
+
+    print(f"{'prefix':<16}{'module':<28}{'import':>10}")
+    for seconds, prefix, module_name in sorted(rows, reverse=True):
+        print(f"{prefix:<16}{module_name:<28}{seconds * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
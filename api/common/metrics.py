@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""
+请求耗时统计。
+
+- MetricsMiddleware: 按路由（模板路径，而不是实际 URL）记录请求耗时直方图和状态码计数，
+  并把本次请求各阶段的耗时写进 Server-Timing 响应头
+- phase(): 在处理函数里标记阶段，例如
+
+      with phase("upstream"):
+          response = await client.get(url)
+
+  常用阶段名：queue（排队）、upstream（请求上游）、parse（解析 HTML）、transcode（ffmpeg）、serialize（序列化响应）
+- register_collector(): 各模块登记自己的连接池、缓存、队列等仪表盘数值，由 /metrics 统一输出
+
+render() 输出 Prometheus 文本格式。流式响应在响应头发出之后的耗时不计入 Server-Timing，但计入直方图。
+"""
+import bisect
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 单位：秒
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_phases: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("phases", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+# (route, method) -> Histogram
+request_latency: Dict[Tuple[str, str], Histogram] = {}
+# (route, phase) -> Histogram
+phase_latency: Dict[Tuple[str, str], Histogram] = {}
+# (route, method, status) -> 次数
+request_count: Dict[Tuple[str, str, str], int] = {}
+in_flight = 0
+
+# 返回 [(指标名, 标签, 数值), ...] 的函数
+Sample = Tuple[str, Dict[str, str], float]
+_collectors: List[Tuple[str, Callable[[], Iterable[Sample]]]] = []
+
+
+def register_collector(name: str, collect: Callable[[], Iterable[Sample]]) -> None:
+    """登记一组仪表盘指标；同名的 collector 只保留最后一次登记的"""
+    _collectors[:] = [(n, c) for n, c in _collectors if n != name]
+    _collectors.append((name, collect))
+
+
+def record_phase(name: str, seconds: float) -> None:
+    """把一段已知耗时记到当前请求的阶段里（不在请求内时忽略）"""
+    phases = _phases.get()
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - start)
+
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    # starlette 0.22 只在 scope 里放 endpoint，按 endpoint 反查路由模板
+    app = scope.get("app")
+    for candidate in getattr(app, "routes", ()):
+        if getattr(candidate, "endpoint", None) is endpoint:
+            return candidate.path
+    return getattr(endpoint, "__name__", "unknown")
+
+
+def _server_timing(phases: Dict[str, float], total: float) -> bytes:
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in phases.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts).encode()
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        global in_flight
+        start = time.perf_counter()
+        phases: Dict[str, float] = {}
+        token = _phases.set(phases)
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", _server_timing(phases, time.perf_counter() - start)))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight -= 1
+            _phases.reset(token)
+            elapsed = time.perf_counter() - start
+            route = _route_label(scope)
+            method = scope["method"]
+            request_latency.setdefault((route, method), Histogram()).observe(elapsed)
+            request_count[(route, method, status)] = request_count.get((route, method, status), 0) + 1
+            for name, seconds in phases.items():
+                phase_latency.setdefault((route, name), Histogram()).observe(seconds)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _render_histograms(lines: List[str], name: str, help_text: str, label_names, histograms) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for label_values, histogram in sorted(histograms.items()):
+        labels = dict(zip(label_names, label_values))
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(dict(labels, le=f'{bound:g}'))} {cumulative}")
+        lines.append(f"{name}_bucket{_labels(dict(labels, le='+Inf'))} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram.sum:.6f}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+
+def render() -> str:
+    lines: List[str] = []
+    _render_histograms(
+        lines, "http_request_duration_seconds", "请求耗时", ("route", "method"), request_latency
+    )
+    _render_histograms(
+        lines, "http_request_phase_seconds", "请求各阶段耗时", ("route", "phase"), phase_latency
+    )
+    lines.append("# HELP http_requests_total 请求数")
+    lines.append("# TYPE http_requests_total counter")
+    for (route, method, status), count in sorted(request_count.items()):
+        lines.append(f"http_requests_total{_labels({'route': route, 'method': method, 'status': status})} {count}")
+    lines.append("# TYPE http_requests_in_flight gauge")
+    lines.append(f"http_requests_in_flight {in_flight}")
+
+    # 同名指标可能来自多个 collector（例如各个缓存），Prometheus 要求同名的样本连续输出
+    gauges: Dict[str, List[str]] = {}
+    for collector_name, collect in _collectors:
+        try:
+            samples = list(collect())
+        except Exception as e:
+            logger.warning(f"采集指标 {collector_name} 失败: {e}")
+            continue
+        for name, labels, value in samples:
+            if value is not None:
+                gauges.setdefault(name, []).append(f"{name}{_labels(labels)} {float(value):g}")
+    for name, samples in gauges.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def stats_samples(prefix: str, stats: dict, labels: Optional[Dict[str, str]] = None) -> List[Sample]:
+    """
+    把 LRUCache.stats() 这类字典转换成指标，只取数值字段，例如
+    stats_samples("cache", search_cache.stats(), {"cache": "bqxs520_search"}) -> cache_entries{cache="bqxs520_search"} ...
+    """
+    labels = labels or {}
+    return [
+        (f"{prefix}_{key}", labels, value)
+        for key, value in stats.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    ]
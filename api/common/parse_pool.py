@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+HTML 解析执行池。
+
+lxml / BeautifulSoup 解析是 CPU 密集操作，直接在 async 处理函数里执行会卡住整个事件循环。
+这里把解析任务放到有界的线程池（默认）或进程池里执行。
+
+可通过环境变量调整：
+- PARSER_POOL: thread（默认）或 process。lxml 解析时会释放 GIL，线程池通常就够用；
+  process 适合 CPU 核数多、页面很大的场景，任务函数和参数必须可 pickle
+- PARSER_POOL_SIZE: 工作线程/进程数，默认 min(4, CPU 核数)
+
+边下载边解析的增量解析器（SearchStreamParser 等）带着状态，不能 pickle，用 run_incremental()：
+线程池模式下同样在解析池里执行，进程池模式下退回到事件循环的默认线程池。
+"""
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+PARSER_POOL = os.getenv("PARSER_POOL", "thread")
+PARSER_POOL_SIZE = int(os.getenv("PARSER_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+
+_executor: Optional[Executor] = None
+# 已提交但还没完成的解析任务数（包括正在执行的）
+pending = 0
+
+
+def _create_executor() -> Executor:
+    if PARSER_POOL == "process":
+        return ProcessPoolExecutor(max_workers=PARSER_POOL_SIZE)
+    if PARSER_POOL != "thread":
+        logger.warning(f"未知的 PARSER_POOL={PARSER_POOL!r}，使用线程池")
+    return ThreadPoolExecutor(max_workers=PARSER_POOL_SIZE, thread_name_prefix="parser")
+
+
+def get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        _executor = _create_executor()
+    return _executor
+
+
+async def run_parser(fn: Callable[..., Any], *args: Any) -> Any:
+    """在解析池中执行 fn(*args)，不阻塞事件循环"""
+    global pending
+    loop = asyncio.get_running_loop()
+    pending += 1
+    try:
+        return await loop.run_in_executor(get_executor(), functools.partial(fn, *args))
+    finally:
+        pending -= 1
+
+
+async def run_incremental(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    在线程里执行 fn(*args)，fn 可以是增量解析器的绑定方法。
+
+    同一个解析器的调用必须逐个 await，不能并发。
+    """
+    global pending
+    loop = asyncio.get_running_loop()
+    executor = get_executor() if PARSER_POOL != "process" else None
+    pending += 1
+    try:
+        return await loop.run_in_executor(executor, functools.partial(fn, *args))
+    finally:
+        pending -= 1
+
+
+async def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
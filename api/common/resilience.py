@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+"""
+上游弹性层：包在 PerHostTransport 外面的传输层，按上游主机分别维护状态。
+
+- 熔断：连续失败（连接错误、超时、5xx）达到阈值后熔断，熔断期间的请求立即抛出 CircuitOpenError，
+  不再占用连接和处理时间；冷却结束后放行一个探测请求，成功则恢复
+- 对冲请求：GET / HEAD 超过该主机最近延迟的 p95 还没返回响应头时，再发一个相同的请求，先返回的胜出，
+  另一个取消。延迟样本不足时不对冲
+- 重试：GET / HEAD 遇到连接错误或 502/503/504 时重试；其他方法只在连接没建立时重试
+- 重试预算：对冲和重试都要从全局预算里取，预算按最近一段时间的原始请求数的比例计算，
+  上游整体故障时重试不会把流量放大
+
+主机状态最多保留 max_hosts 个（create_client 传入 HTTP_MAX_HOSTS），按最近使用淘汰，
+/metrics 里按主机输出的指标数量也因此有上限。
+
+CircuitOpenError 是 httpx.TransportError 的子类，已有的 `except httpx.HTTPError` 处理照常生效。
+
+可通过环境变量调整：
+- HTTP_RESILIENCE: 设为 0 关闭整个弹性层，默认 1
+- HTTP_BREAKER_FAILURES: 连续失败多少次后熔断，默认 5
+- HTTP_BREAKER_COOLDOWN: 熔断持续秒数，默认 30
+- HTTP_HEDGE: 设为 0 关闭对冲请求，默认 1
+- HTTP_HEDGE_MIN_DELAY: 对冲等待时间的下限（秒），默认 0.05
+- HTTP_MAX_RETRIES: 单个请求最多重试次数，默认 1
+- HTTP_RETRY_BUDGET_RATIO: 对冲和重试最多占原始请求数的比例，默认 0.1
+- HTTP_RETRY_BUDGET_MIN: 每秒至少允许的对冲和重试次数（低流量时也能重试），默认 1
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RESILIENCE = os.getenv("HTTP_RESILIENCE", "1") != "0"
+BREAKER_FAILURES = int(os.getenv("HTTP_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("HTTP_BREAKER_COOLDOWN", "30"))
+HEDGE = os.getenv("HTTP_HEDGE", "1") != "0"
+HEDGE_MIN_DELAY = float(os.getenv("HTTP_HEDGE_MIN_DELAY", "0.05"))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "1"))
+RETRY_BUDGET_RATIO = float(os.getenv("HTTP_RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN = float(os.getenv("HTTP_RETRY_BUDGET_MIN", "1"))
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+RETRY_STATUSES = (502, 503, 504)
+# 重试前的随机等待上限（秒）
+RETRY_BACKOFF = 0.1
+# 延迟样本数少于该值时不对冲
+MIN_LATENCY_SAMPLES = 20
+# 默认最多保留多少个上游主机的状态
+MAX_HOSTS = 64
+
+
+class CircuitOpenError(httpx.TransportError):
+    """上游主机处于熔断状态，请求没有发出"""
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.opened = 0
+        self.short_circuited = 0
+
+    def allow(self) -> bool:
+        """是否放行一个请求；半开状态下同一时刻只放行一个探测请求"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                self.short_circuited += 1
+                return False
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                self.short_circuited += 1
+                return False
+            self._probing = True
+        return True
+
+    def success(self) -> None:
+        self.failures = 0
+        self._probing = False
+        self.state = self.CLOSED
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                self.opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def abandon(self) -> None:
+        """请求被取消（例如对冲失败方），不计成功也不计失败"""
+        self._probing = False
+
+
+class LatencyTracker:
+    """最近若干次成功请求的响应头延迟，用来估算 p95"""
+
+    def __init__(self, size: int = 256, recompute_every: int = 16):
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.recompute_every = recompute_every
+        self._since = 0
+        self._p95: Optional[float] = None
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self._since += 1
+        if self._since >= self.recompute_every:
+            self._p95 = None
+
+    def p95(self) -> Optional[float]:
+        if len(self.samples) < MIN_LATENCY_SAMPLES:
+            return None
+        if self._p95 is None:
+            ordered = sorted(self.samples)
+            self._p95 = ordered[int(len(ordered) * 0.95) - 1]
+            self._since = 0
+        return self._p95
+
+
+class RetryBudget:
+    """
+    全局重试预算：最近 window 秒内，对冲和重试的次数不超过
+    max(原始请求数 * ratio, min_per_second * window)。
+    """
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, min_per_second: float = RETRY_BUDGET_MIN, window: float = 10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+        self.exhausted = 0
+
+    def _trim(self, now: float) -> None:
+        cutoff = now - self.window
+        for events in (self._requests, self._retries):
+            while events and events[0] < cutoff:
+                events.popleft()
+
+    def deposit(self) -> None:
+        # 上游健康时很少调用 withdraw，这里也要裁剪，否则请求记录只增不减
+        now = time.monotonic()
+        self._trim(now)
+        self._requests.append(now)
+
+    def withdraw(self) -> bool:
+        now = time.monotonic()
+        self._trim(now)
+        allowed = max(len(self._requests) * self.ratio, self.min_per_second * self.window)
+        if len(self._retries) >= allowed:
+            self.exhausted += 1
+            return False
+        self._retries.append(now)
+        return True
+
+
+class _HostState:
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.retries = 0
+
+
+def _host_key(url: httpx.URL) -> str:
+    return url.host + (f":{url.port}" if url.port else "")
+
+
+async def _discard(tasks) -> None:
+    """取消没用上的请求；已经拿到的响应要关闭，把连接还给连接池"""
+    for task in tasks:
+        task.cancel()
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, httpx.Response):
+            await result.aclose()
+
+
+class ResilientTransport(httpx.AsyncBaseTransport):
+    def __init__(
+        self,
+        inner: httpx.AsyncBaseTransport,
+        hedge: bool = HEDGE,
+        max_retries: int = MAX_RETRIES,
+        max_hosts: int = MAX_HOSTS,
+    ):
+        self.inner = inner
+        self.hedge = hedge
+        self.max_retries = max_retries
+        self.max_hosts = max_hosts
+        self.budget = RetryBudget()
+        self._hosts: "OrderedDict[str, _HostState]" = OrderedDict()
+
+    def _state(self, host: str) -> _HostState:
+        state = self._hosts.get(host)
+        if state is not None:
+            self._hosts.move_to_end(host)
+            return state
+        state = self._hosts[host] = _HostState()
+        while len(self._hosts) > self.max_hosts:
+            # 进行中的请求持有自己的 state，淘汰只影响之后的请求
+            self._hosts.popitem(last=False)
+        return state
+
+    async def _send(self, state: _HostState, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        try:
+            response = await self.inner.handle_async_request(request)
+        except httpx.TransportError:
+            state.breaker.failure()
+            raise
+        except BaseException:
+            state.breaker.abandon()
+            raise
+        if response.status_code >= 500:
+            state.breaker.failure()
+        else:
+            state.breaker.success()
+            state.latency.observe(time.perf_counter() - start)
+        return response
+
+    async def _send_hedged(self, state: _HostState, request: httpx.Request, delay: float) -> httpx.Response:
+        first = asyncio.ensure_future(self._send(state, request))
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or state.breaker.state != CircuitBreaker.CLOSED or not self.budget.withdraw():
+                tasks.discard(first)
+                return await first
+            state.hedges += 1
+            second = asyncio.ensure_future(self._send(state, request))
+            tasks.add(second)
+
+            fallback = error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    response = task.result()
+                    if response.status_code < 500:
+                        if task is second:
+                            state.hedge_wins += 1
+                        if fallback is not None:
+                            await fallback.aclose()
+                        return response
+                    if fallback is None:
+                        fallback = response
+                    else:
+                        await response.aclose()
+            if fallback is not None:
+                return fallback
+            raise error
+        finally:
+            if tasks:
+                await _discard(tasks)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        state = self._state(_host_key(request.url))
+        idempotent = request.method in IDEMPOTENT_METHODS
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            if not state.breaker.allow():
+                raise CircuitOpenError(f"{_host_key(request.url)} 连续失败，暂停请求", request=request)
+            delay = state.latency.p95() if self.hedge and idempotent else None
+            try:
+                if delay is not None:
+                    response = await self._send_hedged(state, request, max(delay, HEDGE_MIN_DELAY))
+                else:
+                    response = await self._send(state, request)
+            except httpx.TransportError as e:
+                # 非幂等请求只在确定没有发出去时重试
+                retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if not retryable or attempt >= self.max_retries or not self.budget.withdraw():
+                    raise
+                logger.info(f"请求 {request.url} 失败（{type(e).__name__}），重试")
+            else:
+                if (
+                    response.status_code not in RETRY_STATUSES
+                    or not idempotent
+                    or attempt >= self.max_retries
+                    or not self.budget.withdraw()
+                ):
+                    return response
+                await response.aclose()
+                logger.info(f"请求 {request.url} 返回 {response.status_code}，重试")
+            attempt += 1
+            state.retries += 1
+            await asyncio.sleep(random.uniform(0, RETRY_BACKOFF))
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+    def stats(self) -> Dict[str, dict]:
+        """每个上游主机的熔断状态、p95 延迟、对冲和重试次数"""
+        result = {}
+        for host, state in list(self._hosts.items()):
+            p95 = state.latency.p95()
+            result[host] = {
+                "breaker": state.breaker.state,
+                "consecutive_failures": state.breaker.failures,
+                "opened": state.breaker.opened,
+                "short_circuited": state.breaker.short_circuited,
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                "hedges": state.hedges,
+                "hedge_wins": state.hedge_wins,
+                "retries": state.retries,
+            }
+        return result
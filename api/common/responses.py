@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+JSON 响应的快速路径和 HTTP 缓存协商。
+
+- FastJSONResponse: 装了 orjson 时用 orjson 序列化，否则退回标准库；中文不转义成 \\uXXXX，不输出多余空格。
+  main.py 把它设为应用的默认响应类，直接返回 dict 的路由也会用到
+- dumps(): 同样的序列化，返回 bytes，用于 NDJSON 等自己拼响应体的场景
+- revalidating_json(): 按响应体内容计算 ETag，带上 Cache-Control；请求的 If-None-Match 命中时返回空的 304
+"""
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from fastapi.responses import JSONResponse, Response
+from starlette.requests import Request
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 没装 orjson 时退回标准库
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def etag_for(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 按弱比较：反向代理压缩响应时常把 ETag 改成 W/"..." """
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    return any((tag[2:] if tag.startswith("W/") else tag) == opaque for tag in candidates)
+
+
+def revalidating_json(
+    request: Request,
+    content: Any,
+    cache_control: str,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """序列化 content 并附上 ETag / Cache-Control；客户端已有同样的内容时返回 304"""
+    body = dumps(content)
+    response_headers = {"ETag": etag_for(body), "Cache-Control": cache_control, **(headers or {})}
+    if etag_matches(request.headers.get("if-none-match"), response_headers["ETag"]):
+        return Response(status_code=304, headers=response_headers)
+    return Response(content=body, media_type="application/json", headers=response_headers)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""
+同一台机器上多个 worker 进程共享的缓存后端。
+
+多个 uvicorn worker 各自的进程内缓存互不相通，worker 越多，每份缓存越冷。
+SQLiteCache 把条目放在一个 WAL 模式的 SQLite 文件里：读操作之间不互相阻塞，也不阻塞写，
+所有 worker 共享同一份热数据，重启进程后缓存仍然有效。
+
+- 每个 namespace（例如 bqxs520_search、avif_output）各自按条目数和字节数限制，超出时淘汰最久未读取的条目
+- 条目带过期时间（墙上时间），过期条目在读取时和淘汰时删除
+- 值为 bytes 时原样存储，其他值编码成 JSON（装了 orjson 时用 orjson）
+- 读取命中时最多每 TOUCH_INTERVAL 秒更新一次访问时间，避免每次读取都要写库
+- 条目数和字节数在内存里累计，写入时不扫描整个 namespace；每 SYNC_INTERVAL 秒从库里重新统计一次，
+  顺便清理过期条目，其他 worker 的写入在这时计入。stats() 只读内存里的数字，不访问数据库
+
+所有方法都是同步的，连接有锁保护，可以在线程池里调用（async 代码用 CacheBackend 的 aget / aset / apop，默认就在线程池里执行）；
+每个进程（fork 之后）使用自己的连接。
+数据库被其他进程长时间锁住等错误只记录日志，按未命中 / 未写入处理，不影响请求。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from api.common.cache import CacheBackend
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 没装 orjson 时退回标准库
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+TOUCH_INTERVAL = 10
+# 多久从数据库重新统计一次条目数和字节数（秒）
+SYNC_INTERVAL = 30
+# 等待其他进程释放写锁的毫秒数
+BUSY_TIMEOUT_MS = 2000
+
+_KIND_BYTES = 0
+_KIND_JSON = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    kind INTEGER NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, accessed_at);
+"""
+
+
+def _encode(value: Any) -> Tuple[int, bytes]:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return _KIND_BYTES, bytes(value)
+    if orjson is not None:
+        return _KIND_JSON, orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return _KIND_JSON, json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _decode(kind: int, data: bytes) -> Any:
+    if kind == _KIND_BYTES:
+        return data
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _key(key: Hashable) -> str:
+    # 元组键（例如 (关键词, UA 类别)）编码成 JSON 数组
+    if isinstance(key, str):
+        return key
+    return json.dumps(key, ensure_ascii=False, separators=(",", ":"))
+
+
+class SQLiteCache(CacheBackend):
+    def __init__(
+        self,
+        path: str,
+        namespace: str,
+        max_entries: int = 1024,
+        max_bytes: int = 16 * 1024 * 1024,
+        ttl: Optional[float] = None,
+    ):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = 0
+        # 本 namespace 的条目数和字节数，上次从数据库统计之后只按本进程的写入增减
+        self._entries: Optional[int] = None
+        self._bytes: Optional[int] = None
+        self._synced_at = 0.0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False)
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL 模式下 NORMAL 只在断电时可能丢失最后几次写入，对缓存来说足够
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+            self._pid = os.getpid()
+            self._sync(conn, time.time())
+        return self._conn
+
+    def _sync(self, conn: sqlite3.Connection, now: float) -> None:
+        """清理过期条目并重新统计条目数和字节数（扫描整个 namespace）"""
+        conn.execute(
+            "DELETE FROM cache WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+            (self.namespace, now),
+        )
+        self._entries, self._bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        self._synced_at = now
+
+    def _forget(self, size: int) -> None:
+        if self._entries is not None:
+            self._entries -= 1
+            self._bytes -= size
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute(
+                    "SELECT kind, value, size, expires_at, accessed_at FROM cache WHERE namespace = ? AND key = ?",
+                    (self.namespace, _key(key)),
+                ).fetchone()
+                if row is not None:
+                    kind, data, size, expires_at, accessed_at = row
+                    if expires_at is not None and expires_at <= now:
+                        conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, _key(key)))
+                        self._forget(size)
+                        row = None
+                    elif now - accessed_at > TOUCH_INTERVAL:
+                        conn.execute(
+                            "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                            (now, self.namespace, _key(key)),
+                        )
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"读取共享缓存 {self.namespace} 失败: {e}")
+            row = None
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return _decode(kind, data)
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        kind, data = _encode(value)
+        if len(data) > self.max_bytes:
+            return False
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    old = conn.execute(
+                        "SELECT size FROM cache WHERE namespace = ? AND key = ?", (self.namespace, _key(key))
+                    ).fetchone()
+                    conn.execute(
+                        "INSERT OR REPLACE INTO cache (namespace, key, kind, value, size, expires_at, accessed_at)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (self.namespace, _key(key), kind, data, len(data), expires_at, now),
+                    )
+                    if old is not None:
+                        self._forget(old[0])
+                    if self._entries is not None:
+                        self._entries += 1
+                        self._bytes += len(data)
+                    self._evict(conn, now)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    # 事务回滚后内存里的统计不可信，下次写入时重新统计
+                    self._entries = self._bytes = None
+                    raise
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"写入共享缓存 {self.namespace} 失败: {e}")
+            return False
+        return True
+
+    def _over_limit(self) -> bool:
+        return self._entries > self.max_entries or self._bytes > self.max_bytes
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        # 缓存写满后每次写入都会超出一点，这里只按内存里的统计淘汰，不重新扫描；
+        # 其他 worker 刚淘汰过时可能多删几条，对缓存无害
+        if self._entries is None or now - self._synced_at > SYNC_INTERVAL:
+            self._sync(conn, now)
+        while self._over_limit():
+            victims = conn.execute(
+                "SELECT key, size FROM cache WHERE namespace = ? ORDER BY accessed_at LIMIT 64", (self.namespace,)
+            ).fetchall()
+            if not victims:
+                break
+            for victim, size in victims:
+                if not self._over_limit():
+                    break
+                conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, victim))
+                self._forget(size)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute(
+                    "SELECT kind, value, size, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                    (self.namespace, _key(key)),
+                ).fetchone()
+                if row is not None:
+                    conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, _key(key)))
+                    self._forget(row[2])
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"删除共享缓存 {self.namespace} 失败: {e}")
+            return default
+        if row is None or (row[3] is not None and row[3] <= time.time()):
+            return default
+        return _decode(row[0], row[1])
+
+    def clear(self) -> None:
+        try:
+            with self._lock:
+                self._connection().execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+                self._entries = self._bytes = 0
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"清空共享缓存 {self.namespace} 失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        # 不访问数据库（会在事件循环里被 /metrics 调用）；还没连接过数据库时为 None
+        return {
+            "backend": "sqlite",
+            "entries": self._entries,
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            # 以下计数只统计本进程
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+"""
+基于共享 httpx 连接池的异步 GitHub 客户端。
+
+- Contents API: 单文件读取 sha / 创建或更新
+- Git Data API: 并发创建 blob，再用一个 tree + commit + 更新 ref 把多个文件一次性提交
+
+可通过环境变量调整：
+- GITHUB_API_BASE: API 地址，默认 https://api.github.com（可以指向本地的假 GitHub 服务做测试，
+  见 bench/fake_github.py）
+- GITHUB_RAW_BASE: 原始文件下载地址，默认 https://raw.githubusercontent.com
+- GITHUB_INDEX_TTL: 路径 -> blob sha 索引在多少秒内直接使用、不向 GitHub 确认，默认 60
+- GITHUB_INDEX_ENTRIES: 最多为多少个 仓库/分支 保存索引，默认 64
+
+上传前需要知道文件当前的 sha。这里不再每次 GET contents，而是为每个 token + 仓库/分支 维护一份
+路径 -> blob sha 的索引：首次用一次递归 tree 请求填满，之后用 If-None-Match 条件请求刷新
+（304 不计入 GitHub 的限流额度），PUT / 提交成功后直接用响应里的 sha 更新。
+"""
+import asyncio
+import base64
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+import httpx
+
+from api.common.cache import LRUCache, SingleFlight, key_hash
+from api.common.http_client import host_semaphore
+from api.common.metrics import phase
+
+logger = logging.getLogger(__name__)
+
+GITHUB_API_BASE = os.getenv("GITHUB_API_BASE", "https://api.github.com").rstrip("/")
+GITHUB_RAW_BASE = os.getenv("GITHUB_RAW_BASE", "https://raw.githubusercontent.com").rstrip("/")
+GITHUB_INDEX_TTL = float(os.getenv("GITHUB_INDEX_TTL", "60"))
+GITHUB_INDEX_ENTRIES = int(os.getenv("GITHUB_INDEX_ENTRIES", "64"))
+
+
+class GitHubError(RuntimeError):
+    def __init__(self, status_code: int, detail):
+        super().__init__(f"GitHub 返回 {status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+def raw_url(owner: str, repo: str, branch: str, path: str) -> str:
+    return f"{GITHUB_RAW_BASE}/{owner}/{repo}/{branch}/{path}"
+
+
+class TreeIndex:
+    """一个 仓库/分支 的 路径 -> blob sha 索引"""
+
+    def __init__(self, paths: Dict[str, str], etag: Optional[str], truncated: bool):
+        self.paths = paths
+        self.etag = etag
+        # 仓库太大时 GitHub 会截断递归 tree，此时索引里查不到的路径不代表文件不存在
+        self.truncated = truncated
+        self.checked_at = time.monotonic()
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() - self.checked_at < GITHUB_INDEX_TTL
+
+
+def _index_size(index: TreeIndex) -> int:
+    return sum(len(path) + 40 for path in index.paths) + 64
+
+
+# (API 地址, token 哈希, owner, repo, branch) -> TreeIndex
+tree_indexes = LRUCache(max_entries=GITHUB_INDEX_ENTRIES, max_bytes=32 * 1024 * 1024, sizeof=_index_size)
+_index_flight = SingleFlight()
+index_stats = {"fresh": 0, "not_modified": 0, "fetched": 0, "fallback": 0}
+
+
+class GitHubClient:
+    def __init__(self, client: httpx.AsyncClient, token: str, owner: str, repo: str):
+        self.client = client
+        self.owner = owner
+        self.repo = repo
+        # 不同 token 能看到的内容可能不同，索引按 token 分开
+        self.token_hash = key_hash(token)
+        self.headers = {
+            "Authorization": f"token {token}",
+            "Accept": "application/vnd.github.v3+json",
+        }
+
+    def _url(self, path: str) -> str:
+        return f"{GITHUB_API_BASE}/repos/{self.owner}/{self.repo}/{path}"
+
+    async def _request(self, method: str, path: str, expected=(200, 201), **kwargs) -> httpx.Response:
+        url = self._url(path)
+        headers = dict(self.headers, **kwargs.pop("headers", {}))
+        # 并发创建 blob 时不要一次性打满 GitHub 的连接
+        async with host_semaphore(url):
+            with phase("upstream"):
+                response = await self.client.request(method, url, headers=headers, **kwargs)
+        if response.status_code not in expected:
+            try:
+                detail = response.json()
+            except ValueError:
+                detail = response.text
+            raise GitHubError(response.status_code, detail)
+        return response
+
+    # ---- Contents API ----
+
+    async def get_content_sha(self, path: str, branch: str) -> Optional[str]:
+        """返回文件当前的 blob sha，文件不存在时返回 None"""
+        response = await self._request(
+            "GET", f"contents/{quote(path)}", expected=(200, 404), params={"ref": branch}
+        )
+        if response.status_code == 404:
+            return None
+        return response.json()["sha"]
+
+    async def put_content(self, path: str, branch: str, content: bytes, message: str, sha: Optional[str] = None) -> dict:
+        data = {
+            "message": message,
+            "content": base64.b64encode(content).decode(),
+            "branch": branch,
+        }
+        if sha:
+            data["sha"] = sha
+        response = await self._request("PUT", f"contents/{quote(path)}", json=data)
+        return response.json()
+
+    async def upload_file(self, path: str, branch: str, content: bytes, message: str) -> dict:
+        """
+        创建或更新单个文件，sha 从索引中取，通常只需要一次 PUT。
+
+        索引过期导致 sha 不对时 GitHub 返回 409/422，此时强制刷新索引后重试一次。
+        """
+        sha = await self.lookup_sha(path, branch)
+        try:
+            result = await self.put_content(path, branch, content, message, sha=sha)
+        except GitHubError as e:
+            if e.status_code not in (409, 422):
+                raise
+            logger.info(f"{path} 的 sha 已过期，刷新索引后重试")
+            await self.tree_index(branch, force=True)
+            sha = await self.lookup_sha(path, branch)
+            result = await self.put_content(path, branch, content, message, sha=sha)
+        self.remember(branch, {path: result["content"]["sha"]})
+        return result
+
+    # ---- 路径 -> sha 索引 ----
+
+    def _index_key(self, branch: str):
+        return (GITHUB_API_BASE, self.token_hash, self.owner, self.repo, branch)
+
+    async def tree_index(self, branch: str, force: bool = False) -> TreeIndex:
+        """
+        返回分支的路径索引。
+
+        索引在 GITHUB_INDEX_TTL 内直接使用；过期后带 If-None-Match 重新请求递归 tree，
+        304 时只刷新检查时间。force=True 时忽略 TTL。并发的刷新请求合并为一次。
+        """
+        key = self._index_key(branch)
+        index = tree_indexes.get(key)
+        if index is not None and index.fresh and not force:
+            index_stats["fresh"] += 1
+            return index
+        return await _index_flight.do(key, lambda: self._refresh_index(branch, index))
+
+    async def _refresh_index(self, branch: str, index: Optional[TreeIndex]) -> TreeIndex:
+        headers = {"If-None-Match": index.etag} if index is not None and index.etag else {}
+        response = await self._request(
+            "GET", f"git/trees/{quote(branch)}", expected=(200, 304),
+            params={"recursive": "1"}, headers=headers,
+        )
+        if response.status_code == 304:
+            index_stats["not_modified"] += 1
+            index.checked_at = time.monotonic()
+            return index
+
+        index_stats["fetched"] += 1
+        data = response.json()
+        paths = {entry["path"]: entry["sha"] for entry in data.get("tree", []) if entry.get("type") == "blob"}
+        index = TreeIndex(paths, response.headers.get("ETag"), bool(data.get("truncated")))
+        tree_indexes.set(self._index_key(branch), index)
+        return index
+
+    async def lookup_sha(self, path: str, branch: str) -> Optional[str]:
+        """返回文件当前的 blob sha，文件不存在时返回 None；分支不存在或索引不完整时回退到 contents 接口"""
+        try:
+            index = await self.tree_index(branch)
+        except GitHubError as e:
+            if e.status_code not in (404, 409):
+                raise
+            # 空仓库或分支不存在，交给 PUT 报错
+            index = None
+        if index is not None and (path in index.paths or not index.truncated):
+            return index.paths.get(path)
+        index_stats["fallback"] += 1
+        return await self.get_content_sha(path, branch)
+
+    def remember(self, branch: str, shas: Dict[str, str]) -> None:
+        """写入成功后用响应里的 sha 更新索引，免得下一次上传前还要重新拉取"""
+        key = self._index_key(branch)
+        index = tree_indexes.get(key)
+        if index is not None:
+            index.paths.update(shas)
+            # 重新登记一次，LRU 按更新后的大小计算
+            tree_indexes.set(key, index)
+
+    # ---- Git Data API ----
+
+    async def get_ref(self, branch: str) -> str:
+        response = await self._request("GET", f"git/ref/heads/{quote(branch)}")
+        return response.json()["object"]["sha"]
+
+    async def get_commit_tree(self, commit_sha: str) -> str:
+        response = await self._request("GET", f"git/commits/{commit_sha}")
+        return response.json()["tree"]["sha"]
+
+    async def create_blob(self, content: bytes) -> str:
+        response = await self._request("POST", "git/blobs", json={
+            "content": base64.b64encode(content).decode(),
+            "encoding": "base64",
+        })
+        return response.json()["sha"]
+
+    async def create_tree(self, base_tree: str, entries: List[dict]) -> str:
+        response = await self._request("POST", "git/trees", json={"base_tree": base_tree, "tree": entries})
+        return response.json()["sha"]
+
+    async def create_commit(self, message: str, tree: str, parent: str) -> str:
+        response = await self._request("POST", "git/commits", json={
+            "message": message,
+            "tree": tree,
+            "parents": [parent],
+        })
+        return response.json()["sha"]
+
+    async def update_ref(self, branch: str, commit_sha: str) -> None:
+        await self._request("PATCH", f"git/refs/heads/{quote(branch)}", json={"sha": commit_sha, "force": False})
+
+    async def commit_files(self, branch: str, files: Dict[str, bytes], message: str) -> dict:
+        """
+        把多个文件作为一次提交推到 branch。
+
+        blob 并发创建，与读取分支最新提交同时进行；之后 tree、commit、ref 各一次请求。
+        返回 {"commit": 提交 sha, "blobs": {路径: blob sha}}。
+        """
+        paths = list(files)
+        head_task = asyncio.ensure_future(self.get_ref(branch))
+        blob_tasks = [asyncio.ensure_future(self.create_blob(files[path])) for path in paths]
+        try:
+            head = await head_task
+            blob_shas = await asyncio.gather(*blob_tasks)
+        except BaseException:
+            head_task.cancel()
+            for task in blob_tasks:
+                task.cancel()
+            raise
+
+        base_tree = await self.get_commit_tree(head)
+        tree = await self.create_tree(base_tree, [
+            {"path": path, "mode": "100644", "type": "blob", "sha": sha}
+            for path, sha in zip(paths, blob_shas)
+        ])
+        commit = await self.create_commit(message, tree, head)
+        # 非 force 更新：期间分支被别人推进时 GitHub 返回 422，不会覆盖别人的提交
+        await self.update_ref(branch, commit)
+        self.remember(branch, dict(zip(paths, blob_shas)))
+        logger.info(f"提交 {len(paths)} 个文件到 {self.owner}/{self.repo}@{branch}: {commit}")
+        return {"commit": commit, "blobs": dict(zip(paths, blob_shas))}
@@ -1,21 +1,65 @@
 from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Form
-import requests
-import base64
+from typing import List
+import httpx
 import os
 import random
 import string
 import json
 from datetime import datetime
+from api.common.http_client import get_http_client
+from api.github_client import GitHubClient, GitHubError, index_stats, raw_url, tree_indexes
 
 router = APIRouter()
 
+# 一次批量上传的文件数上限
+UPLOAD_BATCH_MAX = int(os.getenv("GITHUB_UPLOAD_BATCH_MAX", "100"))
+
+
+def _parse_repo_name(repo_name: str):
+    """'用户名/仓库/目录' -> (用户名, 仓库, 目录)，目录可以为空"""
+    parts = repo_name.split("/")
+    if len(parts) < 2 or not parts[0] or not parts[1]:
+        raise HTTPException(status_code=400, detail="仓库名称格式应为'用户名/仓库/上传到仓库具体目录'")
+    return parts[0], parts[1], "/".join(parts[2:])
+
+
+def _build_file_path(file_content: bytes, filename: str, repo_path: str) -> str:
+    """校验书源 JSON，并根据其中的 bookSourceName 或 sourceName 生成仓库内的文件路径"""
+    # 确保文件是JSON格式
+    try:
+        file_json = json.loads(file_content)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail=f"上传的文件不是有效的JSON格式: {filename}")
+
+    name_field = None
+    if isinstance(file_json, dict):
+        name_field = file_json.get("bookSourceName") or file_json.get("sourceName")
+    elif isinstance(file_json, list) and len(file_json) > 0 and isinstance(file_json[0], dict):
+        name_field = file_json[0].get("bookSourceName") or file_json[0].get("sourceName")
+
+    if not name_field:
+        raise HTTPException(status_code=400, detail=f"JSON文件中缺少bookSourceName或sourceName字段: {filename}")
+
+    # 获取当前时间的时间戳
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    # 随机生成文件名（包含name_field、随机字母和时间戳）
+    random_letters = ''.join(random.choices(string.ascii_letters, k=0))
+    file_extension = os.path.splitext(filename or "")[1]
+    random_file_name = f"{name_field}{random_letters}{timestamp}{file_extension}"
+
+    # 如果指定了具体目录就放在目录下，否则默认保存在根目录
+    return f"{repo_path}/{random_file_name}" if repo_path else random_file_name
+
+
 @router.post("/upload", description="上传本地文件到GitHub仓库，并根据文件内容中的bookSourceName或sourceName生成文件名（包含随机字母和时间戳），返回原始下载链接")
 async def upload_file_to_github(
     repo_name: str = Form(..., description="仓库名称（格式为'用户名/仓库/上传到仓库具体目录'）"),
     branch: str = Form(..., description="分支名称"),
     commit_message: str = Form(..., description="提交信息"),
     access_token: str = Form(..., description="GitHub个人访问令牌"),
-    file: UploadFile = File(..., description="要上传的文件")
+    file: UploadFile = File(..., description="要上传的文件"),
+    client: httpx.AsyncClient = Depends(get_http_client)
 ):
     """
     上传文件到GitHub仓库
@@ -30,74 +74,71 @@ async def upload_file_to_github(
     # 读取文件内容
     file_content = await file.read()
 
-    # 确保文件是JSON格式
+    owner, repo, repo_path = _parse_repo_name(repo_name)
+    random_file_path = _build_file_path(file_content, file.filename, repo_path)
+    github = GitHubClient(client, access_token, owner, repo)
+
     try:
-        file_json = json.loads(file_content)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=400, detail="上传的文件不是有效的JSON格式")
+        # 文件已存在时需要带上 sha 才能更新，sha 从仓库的路径索引中取
+        await github.upload_file(random_file_path, branch, file_content, commit_message)
+    except GitHubError as e:
+        raise HTTPException(status_code=400, detail=f"文件上传失败，错误信息：{e.detail}")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"请求GitHub失败：{str(e)}")
 
-    
-    name_field = None
-    if isinstance(file_json, dict):
-        name_field = file_json.get("bookSourceName") or file_json.get("sourceName")
-    elif isinstance(file_json, list) and len(file_json) > 0:
-        name_field = file_json[0].get("bookSourceName") or file_json[0].get("sourceName")
+    # 获取原始下载链接
+    return {"download_url": raw_url(owner, repo, branch, random_file_path)}
 
-    if not name_field:
-        raise HTTPException(status_code=400, detail="JSON文件中缺少bookSourceName或sourceName字段")
 
-    # 获取当前时间的时间戳
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+@router.post("/upload/batch", description="批量上传书源JSON文件到GitHub仓库，所有文件合并为一次提交，返回每个文件的原始下载链接")
+async def upload_files_to_github(
+    repo_name: str = Form(..., description="仓库名称（格式为'用户名/仓库/上传到仓库具体目录'）"),
+    branch: str = Form(..., description="分支名称"),
+    commit_message: str = Form(..., description="提交信息"),
+    access_token: str = Form(..., description="GitHub个人访问令牌"),
+    files: List[UploadFile] = File(..., description="要上传的文件，可以有多个"),
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
+    """
+    批量上传文件到GitHub仓库
 
-    # 随机生成文件名（包含name_field、随机字母和时间戳）
-    random_letters = ''.join(random.choices(string.ascii_letters, k=0))
-    file_extension = os.path.splitext(file.filename)[1]
-    random_file_name = f"{name_field}{random_letters}{timestamp}{file_extension}"
+    通过 Git Data API 并发创建 blob，再用一个 tree 和一个 commit 提交全部文件，
+    50 个书源只产生一次提交，而不是 100 次串行的 GET/PUT。
 
-    # 解析仓库名称和上传路径
-    parts = repo_name.split("/")
-    if len(parts) > 2:
-        # 如果指定了具体目录
-        repo_path = "/".join(parts[2:])
-        random_file_path = f"{repo_path}/{random_file_name}"
-    else:
-        # 默认保存在根目录
-        random_file_path = random_file_name
-
-    # GitHub API的基础URL
-    base_url = f"https://api.github.com/repos/{parts[0]}/{parts[1]}/contents/{random_file_path}"
-
-    # 获取文件的当前状态（如果存在）
-    headers = {
-        "Authorization": f"token {access_token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
-    response = requests.get(base_url, headers=headers)
-
-    if response.status_code == 200:
-        # 文件已存在，需要更新
-        file_info = response.json()
-        sha = file_info["sha"]
-        data = {
-            "message": commit_message,
-            "content": base64.b64encode(file_content).decode(),
-            "sha": sha,
-            "branch": branch
-        }
-    else:
-        # 文件不存在，需要创建
-        data = {
-            "message": commit_message,
-            "content": base64.b64encode(file_content).decode(),
-            "branch": branch
-        }
-
-    # 发送PUT请求以上传文件
-    response = requests.put(base_url, headers=headers, json=data)
-
-    if response.status_code in [201, 200]:
-        # 获取原始下载链接
-        download_url = f"https://raw.githubusercontent.com/{parts[0]}/{parts[1]}/{branch}/{random_file_path}"
-        return {"download_url": download_url}
-    else:
-        raise HTTPException(status_code=400, detail=f"文件上传失败，错误信息：{response.json()}")
+    :return: {"commit": 提交sha, "files": [{"filename", "path", "download_url"}]}，顺序与上传的文件一致
+    """
+    if len(files) > UPLOAD_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"一次最多上传{UPLOAD_BATCH_MAX}个文件")
+
+    owner, repo, repo_path = _parse_repo_name(repo_name)
+    contents = {}
+    uploaded = []
+    for file in files:
+        file_content = await file.read()
+        path = _build_file_path(file_content, file.filename, repo_path)
+        # 同一秒内同名书源生成的文件名相同，加序号区分
+        base, extension = os.path.splitext(path)
+        n = 1
+        while path in contents:
+            path = f"{base}_{n}{extension}"
+            n += 1
+        contents[path] = file_content
+        uploaded.append({"filename": file.filename, "path": path})
+
+    github = GitHubClient(client, access_token, owner, repo)
+    try:
+        result = await github.commit_files(branch, contents, commit_message)
+    except GitHubError as e:
+        raise HTTPException(status_code=400, detail=f"文件上传失败，错误信息：{e.detail}")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"请求GitHub失败：{str(e)}")
+
+    for item in uploaded:
+        item["download_url"] = raw_url(owner, repo, branch, item["path"])
+    return {"commit": result["commit"], "files": uploaded}
+
+
+@router.get("/cache")
+async def cache_stats():
+    """路径 -> sha 索引的统计：fresh 为直接使用、not_modified 为 304 刷新、fetched 为完整拉取、fallback 为回退到 contents 接口"""
+    return {"requests": index_stats, "indexes": tree_indexes.stats()}
@@ -1,25 +1,269 @@
 #!/usr/bin/env python
+"""
+Groq 的 OpenAI 兼容接口转发。
+
+- 按 API Key（的哈希）缓存 openai.AsyncClient，底层共用全局 httpx 连接池，不再每个请求新建客户端
+- stream=true 时把上游的数据块以 Server-Sent Events 原样转发，首个 token 到达即返回给调用方
+
+可通过环境变量调整：
+- GROQ_BASE_URL: 上游地址，默认 https://api.groq.com/openai/v1
+- GROQ_TIMEOUT: 单次上游调用的超时（秒），默认 600；长回复的生成时间远超共享连接池的默认超时
+- GROQ_CLIENT_CACHE_SIZE: 最多缓存多少个 API Key 的客户端，默认 256
+- GROQ_RESPONSE_CACHE: 设为 1 时默认对所有确定性请求启用响应缓存；否则只对带 X-Groq-Cache: 1 头的请求启用
+- GROQ_RESPONSE_CACHE_ENTRIES / GROQ_RESPONSE_CACHE_BYTES / GROQ_RESPONSE_CACHE_TTL:
+  响应缓存的条目数（默认 1024）、总字节数（默认 32MB）和过期时间（秒，默认 3600）
+
+响应缓存只用于非流式、temperature=0 或指定了 seed 的请求；缓存键是 API Key 哈希 + 模型 + 消息 + 采样参数
+的规范化哈希，不同 API Key 之间互不共享。相同的请求同时到达时只向上游发一次。
+
+所有上游调用都经过 api.v1.limiter 的准入控制排队；X-Priority: batch 的请求排在 interactive（默认）之后。
+上游返回 429 / 503 时按 retry-after 加随机抖动暂停该 API Key，最多重试 GROQ_MAX_RETRIES 次（默认 2）。
+"""
+import hashlib
+import json
+import logging
+import os
+import random
 import typing
 
 import pydantic
-from fastapi import Header
+from fastapi import Depends, Header, HTTPException
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.routing import APIRouter
-from openai import AsyncClient
+from openai import APIConnectionError, APIStatusError, AsyncClient
+import httpx
+
+from api.common import metrics
+from api.common.cache import LRUCache, SingleFlight, key_hash
+from api.common.http_client import get_http_client
+from api.common.metrics import phase, record_phase
+from api.v1.limiter import PRIORITIES, Rejected, Ticket, limiter
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "600"))
+# 客户端对象本身很小，只按条目数限制
+clients = LRUCache(
+    max_entries=int(os.getenv("GROQ_CLIENT_CACHE_SIZE", "256")),
+    max_bytes=1 << 62,
+    sizeof=lambda _: 1,
+)
+MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "2"))
+# retry-after 之外额外等待的随机比例，避免所有被限流的请求在同一时刻重试
+RETRY_JITTER = 0.25
+
+RESPONSE_CACHE_DEFAULT = os.getenv("GROQ_RESPONSE_CACHE", "0") == "1"
+response_cache = LRUCache(
+    max_entries=int(os.getenv("GROQ_RESPONSE_CACHE_ENTRIES", "1024")),
+    max_bytes=int(os.getenv("GROQ_RESPONSE_CACHE_BYTES", str(32 * 1024 * 1024))),
+    ttl=float(os.getenv("GROQ_RESPONSE_CACHE_TTL", "3600")),
+)
+_inflight = SingleFlight()
+response_cache_stats = {"coalesced": 0, "bytes_saved": 0, "tokens_saved": 0, "uncacheable": 0}
+
+
+def _collect_metrics():
+    limits = limiter.stats()
+    yield "groq_clients", {}, len(clients)
+    yield from metrics.stats_samples("cache", dict(response_cache.stats(), **response_cache_stats), {"cache": "groq_responses"})
+    yield from metrics.stats_samples("groq_limiter", {key: value for key, value in limits.items() if key != "queued"})
+    for priority, count in limits["queued"].items():
+        yield "groq_limiter_queued", {"priority": priority}, count
+
+
+metrics.register_collector("groq", _collect_metrics)
 
 
 class ChatArgs(pydantic.BaseModel):
     model: str
-    messages: typing.List[typing.Dict[str, str]]
+    messages: typing.List[typing.Dict[str, typing.Any]]
+    temperature: typing.Optional[float] = None
+    top_p: typing.Optional[float] = None
+    max_tokens: typing.Optional[int] = None
+    stop: typing.Optional[typing.Union[str, typing.List[str]]] = None
+    seed: typing.Optional[int] = None
+    stream: bool = False
+
+    @property
+    def deterministic(self) -> bool:
+        return not self.stream and (self.temperature == 0 or self.seed is not None)
+
+    def estimate_tokens(self) -> int:
+        """粗略估算本次调用消耗的 token（约 4 个字符 1 个 token + 输出上限），用于 TPM 令牌桶"""
+        chars = sum(len(str(message.get("content", ""))) for message in self.messages)
+        return chars // 4 + (self.max_tokens or 256)
+
+
+def get_api_key(authorization: str = Header(...)) -> str:
+    scheme, _, api_key = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not api_key.strip():
+        raise HTTPException(status_code=401, detail="Authorization 头应为 'Bearer <API Key>'")
+    return api_key.strip()
+
+
+def get_client(api_key: str, http_client: httpx.AsyncClient) -> AsyncClient:
+    """
+    返回该 API Key 对应的客户端。
+
+    全局 httpx 客户端被关闭重建后（例如 shutdown 之后），旧的 openai 客户端也随之作废。
+    """
+    cache_key = key_hash(api_key)
+    client = clients.get(cache_key)
+    if client is None or client._client is not http_client:
+        # 重试由准入控制统一处理，SDK 自带的重试不受排队限制，这里关掉
+        # 传入了 http_client 时 openai 会沿用它的超时（HTTP_TIMEOUT），这里显式指定
+        client = AsyncClient(
+            base_url=GROQ_BASE_URL,
+            api_key=api_key,
+            http_client=http_client,
+            max_retries=0,
+            timeout=GROQ_TIMEOUT,
+        )
+        clients.set(cache_key, client)
+    return client
+
+
+def _upstream_error(e: Exception) -> Response:
+    if isinstance(e, APIStatusError):
+        # 原样转发上游的错误响应，保持 OpenAI 的 {"error": {...}} 格式
+        return Response(
+            content=e.response.content,
+            status_code=e.status_code,
+            media_type=e.response.headers.get("content-type", "application/json"),
+        )
+    logger.error(f"请求 Groq 失败: {e}")
+    return JSONResponse(status_code=502, content={"error": {"message": f"请求上游失败: {e}"}})
+
+
+def _retry_after(response: httpx.Response, attempt: int) -> float:
+    """上游建议的等待秒数，没有时按指数退避"""
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1)):
+        value = response.headers.get(name)
+        if value:
+            try:
+                return float(value) * scale
+            except ValueError:
+                pass
+    return float(2 ** attempt)
+
+
+async def create_completion(
+    client: AsyncClient, api_key: str, args: ChatArgs, priority: str
+) -> typing.Tuple[typing.Any, typing.Optional[Ticket]]:
+    """
+    排队后调用上游。非流式调用返回时名额已归还；流式调用返回 (stream, ticket)，由调用方在流结束后归还。
+    """
+    key = key_hash(api_key)
+    tokens = args.estimate_tokens()
+    for attempt in range(MAX_RETRIES + 1):
+        ticket = await limiter.acquire(key, tokens, priority)
+        record_phase("queue", ticket.waited)
+        try:
+            with phase("upstream"):
+                result = await client.chat.completions.create(**args.dict(exclude_none=True))
+        except APIStatusError as e:
+            limiter.release(ticket)
+            if e.status_code not in (429, 503) or attempt == MAX_RETRIES:
+                raise
+            delay = _retry_after(e.response, attempt) * (1 + random.uniform(0, RETRY_JITTER))
+            logger.warning(f"Groq 返回 {e.status_code}，API Key {key} 暂停 {delay:.1f}s 后重试")
+            limiter.pause(key, delay)
+            continue
+        except BaseException:
+            limiter.release(ticket)
+            raise
+        if args.stream:
+            return result, ticket
+        usage = getattr(result, "usage", None)
+        limiter.release(ticket, used_tokens=usage.total_tokens if usage else None)
+        return result, None
+
+
+def response_cache_key(api_key: str, args: ChatArgs) -> str:
+    payload = args.dict(exclude_none=True)
+    payload.pop("stream", None)
+    canonical = json.dumps([key_hash(api_key), payload], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+async def _cached_completion(client: AsyncClient, api_key: str, args: ChatArgs, priority: str) -> Response:
+    key = response_cache_key(api_key, args)
+    body = response_cache.get(key)
+    if body is not None:
+        response_cache_stats["bytes_saved"] += len(body)
+        response_cache_stats["tokens_saved"] += (json.loads(body).get("usage") or {}).get("total_tokens", 0)
+        return Response(content=body, media_type="application/json", headers={"X-Cache": "HIT"})
+
+    async def load() -> bytes:
+        result, _ = await create_completion(client, api_key, args, priority)
+        data = result.json().encode()
+        response_cache.set(key, data)
+        return data
+
+    if key in _inflight:
+        response_cache_stats["coalesced"] += 1
+    body = await _inflight.do(key, load)
+    return Response(content=body, media_type="application/json", headers={"X-Cache": "MISS"})
+
+
+async def _sse(stream, ticket: Ticket) -> typing.AsyncIterator[str]:
+    try:
+        async for chunk in stream:
+            yield f"data: {chunk.json(exclude_unset=True)}\n\n"
+    except (APIStatusError, APIConnectionError, httpx.HTTPError) as e:
+        # 响应头已经发出，只能把错误作为一个事件发给调用方
+        logger.error(f"Groq 流式响应中断: {e}")
+        yield f"data: {json.dumps({'error': {'message': str(e)}}, ensure_ascii=False)}\n\n"
+    finally:
+        await stream.response.aclose()
+        limiter.release(ticket)
+    yield "data: [DONE]\n\n"
 
 
 @router.post("/chat/completions")
-async def groq_api(args: ChatArgs, authorization: str = Header(...)):
-    api_key = authorization.split(" ")[1]
-    client = AsyncClient(base_url="https://api.groq.com/openai/v1",
-                         api_key=api_key)
-    return await client.chat.completions.create(
-        model=args.model,
-        messages=args.messages,
+async def groq_api(
+    args: ChatArgs,
+    api_key: str = Depends(get_api_key),
+    x_groq_cache: typing.Optional[str] = Header(None),
+    x_priority: str = Header("interactive"),
+    http_client: httpx.AsyncClient = Depends(get_http_client),
+):
+    client = get_client(api_key, http_client)
+    use_cache = x_groq_cache == "1" if x_groq_cache is not None else RESPONSE_CACHE_DEFAULT
+    priority = x_priority if x_priority in PRIORITIES else "interactive"
+    try:
+        if use_cache:
+            if args.deterministic:
+                return await _cached_completion(client, api_key, args, priority)
+            response_cache_stats["uncacheable"] += 1
+        result, ticket = await create_completion(client, api_key, args, priority)
+    except Rejected as e:
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": str(e), "type": "rate_limit_exceeded"}},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except (APIStatusError, APIConnectionError) as e:
+        return _upstream_error(e)
+
+    if not args.stream:
+        return Response(content=result.json(), media_type="application/json")
+    return StreamingResponse(
+        _sse(result, ticket),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
+
+
+@router.get("/cache")
+async def cache_stats():
+    """响应缓存的命中率、合并的并发请求数，以及省下的字节数和 token 数"""
+    return {"responses": dict(response_cache.stats(), **response_cache_stats), "clients": len(clients)}
+
+
+@router.get("/limits")
+async def limit_stats():
+    """准入控制的状态：进行中、按优先级排队的请求数，被拒绝、超时和被上游要求暂停的次数"""
+    return limiter.stats()
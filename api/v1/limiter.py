@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+"""
+Groq 转发的准入控制。
+
+一个 API Key 的突发请求会把上游打出 429，进而拖累所有调用方。这里在转发前统一排队：
+- 全局并发上限和每个 API Key 的并发上限
+- 每个 API Key 的令牌桶：每分钟请求数（RPM）和每分钟 token 数（TPM）
+- 小型优先级队列：interactive 先于 batch，同一优先级按到达顺序
+- 上游返回 429 / 503 时按 retry-after（加随机抖动）暂停该 API Key 的后续请求
+
+可通过环境变量调整：
+- GROQ_MAX_CONCURRENCY: 全局并发上限，默认 16
+- GROQ_KEY_MAX_CONCURRENCY: 每个 API Key 的并发上限，默认 4
+- GROQ_KEY_RPM: 每个 API Key 每分钟请求数，默认 30，0 表示不限
+- GROQ_KEY_TPM: 每个 API Key 每分钟 token 数，默认 6000，0 表示不限
+- GROQ_QUEUE_SIZE: 排队请求数上限，超过时直接拒绝，默认 64
+- GROQ_QUEUE_TIMEOUT: 单个请求最多排队多少秒，默认 30
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from typing import Dict, List, Optional
+
+MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "16"))
+KEY_MAX_CONCURRENCY = int(os.getenv("GROQ_KEY_MAX_CONCURRENCY", "4"))
+KEY_RPM = float(os.getenv("GROQ_KEY_RPM", "30"))
+KEY_TPM = float(os.getenv("GROQ_KEY_TPM", "6000"))
+QUEUE_SIZE = int(os.getenv("GROQ_QUEUE_SIZE", "64"))
+QUEUE_TIMEOUT = float(os.getenv("GROQ_QUEUE_TIMEOUT", "30"))
+
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class Rejected(Exception):
+    """队列已满或排队超时"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """每分钟补充 per_minute 个令牌，容量同样为 per_minute；per_minute <= 0 表示不限"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """还要等多少秒才有 amount 个令牌；超过容量的请求按容量算，否则永远发不出去"""
+        if self.rate <= 0:
+            return 0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float, now: float) -> None:
+        if self.rate > 0:
+            self._refill(now)
+            self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount: float) -> None:
+        """按实际用量修正：多扣的还回去，少扣的记为欠账（令牌数可以为负）"""
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _KeyState:
+    def __init__(self, rpm: float, tpm: float):
+        self.active = 0
+        self.rpm = TokenBucket(rpm)
+        self.tpm = TokenBucket(tpm)
+        self.paused_until = 0.0
+
+
+class Ticket:
+    """一次获准的上游调用，用完后必须交给 release"""
+
+    def __init__(self, key: str, tokens: int, waited: float):
+        self.key = key
+        self.tokens = tokens
+        self.waited = waited
+        self.released = False
+
+
+class _Waiter:
+    def __init__(self, priority: int, seq: int, key: str, tokens: int, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.key = key
+        self.tokens = tokens
+        self.future = future
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrency: int = MAX_CONCURRENCY,
+        key_max_concurrency: int = KEY_MAX_CONCURRENCY,
+        key_rpm: float = KEY_RPM,
+        key_tpm: float = KEY_TPM,
+        queue_size: int = QUEUE_SIZE,
+        queue_timeout: float = QUEUE_TIMEOUT,
+    ):
+        self.max_concurrency = max_concurrency
+        self.key_max_concurrency = key_max_concurrency
+        self.key_rpm = key_rpm
+        self.key_tpm = key_tpm
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._queue: List[_Waiter] = []
+        self._keys: Dict[str, _KeyState] = {}
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_at = math.inf
+        self.granted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.pauses = 0
+
+    def _state(self, key: str) -> _KeyState:
+        state = self._keys.get(key)
+        if state is None:
+            if len(self._keys) >= 4096:
+                self._prune()
+            state = self._keys[key] = _KeyState(self.key_rpm, self.key_tpm)
+        return state
+
+    def _prune(self) -> None:
+        """清理没有进行中请求、也没有排队请求的 API Key 状态"""
+        queued = {waiter.key for waiter in self._queue}
+        for key in [key for key, state in self._keys.items() if state.active == 0 and key not in queued]:
+            del self._keys[key]
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(len(self._queue) / max(self.max_concurrency, 1)))
+
+    async def acquire(self, key: str, tokens: int, priority: str = "interactive") -> Ticket:
+        if len(self._queue) >= self.queue_size:
+            self.rejected += 1
+            raise Rejected("请求排队已满", self.retry_after())
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(PRIORITIES.get(priority, 0), next(self._seq), key, tokens, loop.create_future())
+        self._state(key)
+        heapq.heappush(self._queue, waiter)
+        enqueued = time.monotonic()
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done():
+                # 刚好在超时/取消的同时获准，名额要还回去
+                self._release(key)
+            else:
+                waiter.future.cancel()
+                self._queue.remove(waiter)
+                heapq.heapify(self._queue)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+                raise Rejected(f"排队超过 {self.queue_timeout:g}s", self.retry_after())
+            raise
+        return Ticket(key, tokens, time.monotonic() - enqueued)
+
+    def release(self, ticket: Ticket, used_tokens: Optional[int] = None) -> None:
+        """调用结束。used_tokens 为上游返回的实际用量，用来修正 TPM 令牌桶"""
+        if ticket.released:
+            return
+        ticket.released = True
+        if used_tokens is not None:
+            self._state(ticket.key).tpm.adjust(ticket.tokens - used_tokens)
+        self._release(ticket.key)
+
+    def _release(self, key: str) -> None:
+        self._state(key).active -= 1
+        self.active -= 1
+        self._dispatch()
+
+    def pause(self, key: str, seconds: float) -> None:
+        """上游要求该 API Key 等待 seconds 秒（retry-after）"""
+        state = self._state(key)
+        state.paused_until = max(state.paused_until, time.monotonic() + seconds)
+        self.pauses += 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """按优先级依次放行；被自身 API Key 的限制挡住的请求不会阻塞其他 API Key 的请求"""
+        now = time.monotonic()
+        wake_in = math.inf
+        blocked = []
+        while self._queue and self.active < self.max_concurrency:
+            waiter = heapq.heappop(self._queue)
+            if waiter.future.done():
+                continue
+            state = self._state(waiter.key)
+            if state.active >= self.key_max_concurrency:
+                blocked.append(waiter)
+                continue
+            delay = max(
+                state.paused_until - now,
+                state.rpm.wait_time(1, now),
+                state.tpm.wait_time(waiter.tokens, now),
+            )
+            if delay > 0:
+                wake_in = min(wake_in, delay)
+                blocked.append(waiter)
+                continue
+            state.active += 1
+            self.active += 1
+            state.rpm.take(1, now)
+            state.tpm.take(waiter.tokens, now)
+            self.granted += 1
+            waiter.future.set_result(None)
+        for waiter in blocked:
+            heapq.heappush(self._queue, waiter)
+
+        # 被令牌桶或 retry-after 挡住时，到时间再检查一次
+        if wake_in < math.inf and now + wake_in < self._timer_at:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer_at = now + wake_in
+            self._timer = asyncio.get_running_loop().call_later(wake_in, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._timer_at = math.inf
+        self._dispatch()
+
+    def stats(self) -> dict:
+        queued = {name: 0 for name in PRIORITIES}
+        names = {value: name for name, value in PRIORITIES.items()}
+        for waiter in self._queue:
+            if not waiter.future.done():
+                queued[names[waiter.priority]] += 1
+        now = time.monotonic()
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "key_max_concurrency": self.key_max_concurrency,
+            "queued": queued,
+            "keys": len(self._keys),
+            "paused_keys": sum(1 for state in self._keys.values() if state.paused_until > now),
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "pauses": self.pauses,
+        }
+
+
+limiter = AdmissionController()
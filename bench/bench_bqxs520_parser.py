@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+详情页解析器微基准：旧的逐字段 XPath 实现 vs api.bqxs520_parser 的单次遍历实现。
+
+用法（在仓库根目录）:
+    python -m bench.bench_bqxs520_parser [--number 200] [--fixture bench/fixtures/bqxs520_detail.html]
+
+两种实现先对同一份页面做结果比对，不一致时直接报错退出。
+
+在自带的 fixture 上，提取阶段约快 2.1–2.7 倍，加上 etree.HTML 之后的端到端约快 1.3–1.4 倍（随机器不同），
+etree.HTML 本身没有变化，占了总耗时的大头。
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+from api.bqxs520_parser import extract_detail, parse_html
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def _xpath_text(root, expr):
+    value = root.xpath(expr)
+    if value is None or value.strip() == "":
+        return None
+    return value
+
+
+def legacy_extract_detail(root):
+    """改造前 `detail` 接口里的提取逻辑（去掉了 print 和 BeautifulSoup 兜底）"""
+    update_time = root.xpath("string(//p[3]/text())")
+    description_p5 = root.xpath("string(//p[5])").strip()
+    description_p6 = root.xpath("string(//p[6])").strip()
+    description = f"{description_p5}\n{description_p6}"
+    if description == "\n":
+        description = ""
+
+    property_dict = {
+        "book_name": _xpath_text(root, "string(//meta[@property='og:novel:book_name']/@content)"),
+        "author": _xpath_text(root, "string(//meta[@property='og:novel:author']/@content)"),
+        "description": _xpath_text(root, "string(//meta[@property='og:description']/@content)"),
+        "category": _xpath_text(root, "string(//meta[@property='og:novel:category']/@content)"),
+        "status": _xpath_text(root, "string(//meta[@property='og:novel:status']/@content)"),
+        "lastest_chapter_name": _xpath_text(root, "string(//meta[@property='og:novel:lastest_chapter_name']/@content)"),
+        "update_time": _xpath_text(root, "string(//meta[@property='og:novel:update_time']/@content)"),
+    }
+
+    itags = [tag.strip() for tag in root.xpath("//p[@class='itag']/a/text()")]
+
+    protagonists = []
+    for element in root.xpath("//div[@class='info']/p[1]/span"):
+        clean_text = " ".join("".join(element.itertext()).strip().split())
+        if clean_text:
+            protagonists.append(clean_text)
+
+    first_chapter_id = ""
+    chapter_links = root.xpath('//div[@class="chapterlist"]/a')
+    if chapter_links:
+        onclick_attr = chapter_links[0].get("onclick")
+        if onclick_attr:
+            match = re.search(r"read\((\d+)\)", onclick_attr)
+            if match:
+                first_chapter_id = match.group(1)
+
+    return {
+        "bookname": _xpath_text(root, "string(//h1/span/text())"),
+        "author": _xpath_text(root, "string(//div[@class='title']/span/a/text())"),
+        "update_time": update_time.strip() if update_time else None,
+        "lastest_chapter_name": _xpath_text(root, "string(//p[4]/text())"),
+        "description": description,
+        "img": _xpath_text(root, "string(//img/@src)"),
+        "property": property_dict,
+        "itag": ", ".join(itags),
+        "protagonist": ", ".join(protagonists),
+        "list_id": first_chapter_id,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=200, help="每种实现的执行次数")
+    parser.add_argument("--fixture", default=os.path.join(FIXTURE_DIR, "bqxs520_detail.html"))
+    args = parser.parse_args(argv)
+
+    with open(args.fixture, encoding="utf-8") as f:
+        content = f.read()
+
+    root = parse_html(content)
+    expected = legacy_extract_detail(root)
+    actual = extract_detail(root)
+    if expected != actual:
+        print("解析结果不一致:", file=sys.stderr)
+        print(f"  legacy: {expected}", file=sys.stderr)
+        print(f"  new:    {actual}", file=sys.stderr)
+        return 1
+
+    def per_page(fn):
+        return min(timeit.repeat(fn, number=args.number, repeat=3)) / args.number * 1000
+
+    # HTML 解析（etree.HTML）两种实现相同，单独列出；提取阶段在同一棵树上比较
+    html = per_page(lambda: parse_html(content))
+    legacy = per_page(lambda: legacy_extract_detail(root))
+    new = per_page(lambda: extract_detail(root))
+    print(f"fixture: {args.fixture} ({len(content.encode('utf-8'))} bytes)")
+    print(f"etree.HTML           : {html:.3f} ms/page")
+    print(f"extract legacy xpath : {legacy:.3f} ms/page  (total {html + legacy:.3f})")
+    print(f"extract single pass  : {new:.3f} ms/page  (total {html + new:.3f})")
+    print(f"extract speedup      : {legacy / new:.2f}x, total {(html + legacy) / (html + new):.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
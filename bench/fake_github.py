@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+本地假 GitHub：在内存里实现上传接口用到的 Contents API 和 Git Data API 子集，
+用来在不访问 GitHub、不消耗限流额度的情况下测试 /github/upload 与 /github/upload/batch。
+
+用法:
+    uvicorn bench.fake_github:app --port 9100
+    GITHUB_API_BASE=http://127.0.0.1:9100 uvicorn main:app
+
+仓库和 main 分支在首次访问时自动创建（初始提交为空树）。GET /_stats 返回各接口的调用次数。
+"""
+import base64
+import hashlib
+import json
+from collections import Counter
+
+from fastapi import Body, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+
+app = FastAPI()
+calls = Counter()
+
+
+def _sha(kind: str, data: bytes) -> str:
+    return hashlib.sha1(f"{kind} {len(data)}\0".encode() + data).hexdigest()
+
+
+class Repo:
+    def __init__(self):
+        self.blobs = {}
+        # tree sha -> {path: blob sha}，只用扁平的路径表示，足够模拟 base_tree 合并
+        self.trees = {}
+        self.commits = {}
+        empty_tree = self.put_tree({})
+        root = self.put_commit("initial commit", empty_tree, [])
+        self.refs = {"main": root}
+
+    def put_blob(self, content: bytes) -> str:
+        sha = _sha("blob", content)
+        self.blobs[sha] = content
+        return sha
+
+    def put_tree(self, entries: dict) -> str:
+        sha = _sha("tree", json.dumps(entries, sort_keys=True).encode())
+        self.trees[sha] = dict(entries)
+        return sha
+
+    def put_commit(self, message: str, tree: str, parents: list) -> str:
+        sha = _sha("commit", json.dumps([message, tree, parents, len(self.commits)]).encode())
+        self.commits[sha] = {"sha": sha, "message": message, "tree": {"sha": tree}, "parents": [{"sha": p} for p in parents]}
+        return sha
+
+    def head_tree(self, branch: str) -> dict:
+        commit = self.commits[self.refs[branch]]
+        return self.trees[commit["tree"]["sha"]]
+
+
+repos = {}
+
+
+def get_repo(owner: str, repo: str) -> Repo:
+    return repos.setdefault((owner, repo), Repo())
+
+
+def _endpoint(path: str) -> str:
+    """/repos/o/r/git/blobs -> git/blobs，/repos/o/r/contents/a/b.json -> contents"""
+    parts = path.split("/")[4:]
+    if not parts:
+        return path
+    return "/".join(parts[:2]) if parts[0] == "git" else parts[0]
+
+
+@app.middleware("http")
+async def count_calls(request: Request, call_next):
+    if request.url.path.startswith("/repos/"):
+        calls[f"{request.method} {_endpoint(request.url.path)}"] += 1
+    return await call_next(request)
+
+
+@app.get("/_stats")
+async def stats():
+    return dict(calls)
+
+
+@app.get("/repos/{owner}/{repo}/contents/{path:path}")
+async def get_content(owner: str, repo: str, path: str, ref: str = "main"):
+    r = get_repo(owner, repo)
+    if ref not in r.refs:
+        raise HTTPException(404, "No commit found for the ref")
+    sha = r.head_tree(ref).get(path)
+    if sha is None:
+        raise HTTPException(404, "Not Found")
+    return {"path": path, "sha": sha, "content": base64.b64encode(r.blobs[sha]).decode()}
+
+
+@app.put("/repos/{owner}/{repo}/contents/{path:path}", status_code=201)
+async def put_content(owner: str, repo: str, path: str, body: dict = Body(...)):
+    r = get_repo(owner, repo)
+    branch = body.get("branch", "main")
+    if branch not in r.refs:
+        raise HTTPException(404, "Branch not found")
+    entries = r.head_tree(branch)
+    if path in entries and body.get("sha") != entries[path]:
+        raise HTTPException(409, f"{path} does not match {body.get('sha')}")
+    blob = r.put_blob(base64.b64decode(body["content"]))
+    entries = dict(entries, **{path: blob})
+    commit = r.put_commit(body["message"], r.put_tree(entries), [r.refs[branch]])
+    r.refs[branch] = commit
+    return {"content": {"path": path, "sha": blob}, "commit": {"sha": commit}}
+
+
+@app.get("/repos/{owner}/{repo}/git/ref/heads/{branch:path}")
+async def get_ref(owner: str, repo: str, branch: str):
+    r = get_repo(owner, repo)
+    if branch not in r.refs:
+        raise HTTPException(404, "Not Found")
+    return {"ref": f"refs/heads/{branch}", "object": {"type": "commit", "sha": r.refs[branch]}}
+
+
+@app.get("/repos/{owner}/{repo}/git/commits/{sha}")
+async def get_commit(owner: str, repo: str, sha: str):
+    r = get_repo(owner, repo)
+    if sha not in r.commits:
+        raise HTTPException(404, "Not Found")
+    return r.commits[sha]
+
+
+@app.get("/repos/{owner}/{repo}/git/trees/{tree_ish:path}")
+async def get_tree(owner: str, repo: str, tree_ish: str, request: Request):
+    """tree_ish 可以是分支名或 tree sha；和 GitHub 一样返回 ETag，If-None-Match 命中时返回 304"""
+    r = get_repo(owner, repo)
+    tree_sha = r.commits[r.refs[tree_ish]]["tree"]["sha"] if tree_ish in r.refs else tree_ish
+    if tree_sha not in r.trees:
+        raise HTTPException(404, "Not Found")
+    etag = f'W/"{tree_sha}"'
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    tree = [{"path": path, "mode": "100644", "type": "blob", "sha": sha} for path, sha in sorted(r.trees[tree_sha].items())]
+    return JSONResponse({"sha": tree_sha, "tree": tree, "truncated": False}, headers={"ETag": etag})
+
+
+@app.post("/repos/{owner}/{repo}/git/blobs", status_code=201)
+async def create_blob(owner: str, repo: str, body: dict = Body(...)):
+    content = body["content"]
+    data = base64.b64decode(content) if body.get("encoding") == "base64" else content.encode()
+    return {"sha": get_repo(owner, repo).put_blob(data)}
+
+
+@app.post("/repos/{owner}/{repo}/git/trees", status_code=201)
+async def create_tree(owner: str, repo: str, body: dict = Body(...)):
+    r = get_repo(owner, repo)
+    entries = dict(r.trees.get(body.get("base_tree"), {}))
+    for entry in body["tree"]:
+        if entry["sha"] not in r.blobs:
+            raise HTTPException(422, f"Blob {entry['sha']} not found")
+        entries[entry["path"]] = entry["sha"]
+    return {"sha": r.put_tree(entries)}
+
+
+@app.post("/repos/{owner}/{repo}/git/commits", status_code=201)
+async def create_commit(owner: str, repo: str, body: dict = Body(...)):
+    r = get_repo(owner, repo)
+    if body["tree"] not in r.trees:
+        raise HTTPException(422, "Tree not found")
+    return {"sha": r.put_commit(body["message"], body["tree"], body.get("parents", []))}
+
+
+@app.patch("/repos/{owner}/{repo}/git/refs/heads/{branch:path}")
+async def update_ref(owner: str, repo: str, branch: str, body: dict = Body(...)):
+    r = get_repo(owner, repo)
+    if branch not in r.refs:
+        raise HTTPException(422, "Reference does not exist")
+    commit = r.commits.get(body["sha"])
+    if commit is None:
+        raise HTTPException(422, "Object does not exist")
+    parents = [p["sha"] for p in commit["parents"]]
+    if not body.get("force") and r.refs[branch] not in parents:
+        raise HTTPException(422, "Update is not a fast forward")
+    r.refs[branch] = body["sha"]
+    return {"ref": f"refs/heads/{branch}", "object": {"type": "commit", "sha": body["sha"]}}
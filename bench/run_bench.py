@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+"""
+离线基准测试：启动 bench/stub_upstream.py 模拟所有上游，再启动指向它的应用，按固定并发压测各个路由。
+
+每个场景输出 req/s、p50/p95/p99 延迟、错误数和应用进程的 RSS；可以保存为基线，之后和基线比较，
+req/s 下降或 p95 上升超过阈值时以非 0 退出码结束。全程不访问外网，需要安装 uvicorn 和 ffmpeg。
+
+用法（在仓库根目录）:
+    python -m bench.run_bench                                   # 跑全部场景
+    python -m bench.run_bench --only search_cold,avif_webp_cold -n 500 -c 32
+    python -m bench.run_bench --save-baseline bench/baseline.json
+    python -m bench.run_bench --baseline bench/baseline.json --threshold 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Scenario(NamedTuple):
+    # i -> httpx.AsyncClient.request 的参数
+    build: Callable[[int, str], dict]
+    # 场景自己的请求数上限（例如 GitHub 批量上传不需要几百次）
+    max_requests: Optional[int] = None
+    # 场景自己的并发上限
+    max_concurrency: Optional[int] = None
+
+
+def _chat(i: int, stream: bool = False) -> dict:
+    return {
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "headers": {"Authorization": "Bearer bench-key"},
+        "json": {"model": "bench", "messages": [{"role": "user", "content": f"hello {i}"}], "stream": stream},
+    }
+
+
+def _github_batch(i: int) -> dict:
+    files = [
+        ("files", (f"source{j}.json", json.dumps({"bookSourceName": f"bench{i}_{j}"}), "application/json"))
+        for j in range(10)
+    ]
+    data = {"repo_name": "bench/sources/books", "branch": "main", "commit_message": f"bench {i}", "access_token": "x"}
+    return {"method": "POST", "url": "/github/upload/batch", "data": data, "files": files}
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "hello": Scenario(lambda i, stub: {"method": "GET", "url": "/hello/"}),
+    "proxy": Scenario(lambda i, stub: {"method": "GET", "url": "/proxy"}),
+    "search_hot": Scenario(lambda i, stub: {"method": "GET", "url": "/bqxs520/search", "params": {"query": "热门"}}),
+    "search_cold": Scenario(lambda i, stub: {"method": "GET", "url": "/bqxs520/search", "params": {"query": f"q{i}"}}),
+    "search_stream": Scenario(
+        lambda i, stub: {"method": "GET", "url": "/bqxs520/search", "params": {"query": f"s{i}", "stream": "true"}}
+    ),
+    "detail_cold": Scenario(lambda i, stub: {"method": "GET", "url": "/bqxs520/detail", "params": {"book_id": f"1_{i}_1"}}),
+    "detail_batch": Scenario(
+        lambda i, stub: {
+            "method": "POST", "url": "/bqxs520/detail/batch",
+            "json": {"book_ids": [f"2_{i}_{j}" for j in range(20)]},
+        },
+        max_requests=50,
+    ),
+    "avif_png_cold": Scenario(
+        lambda i, stub: {"method": "GET", "url": "/aviftonpng/to", "params": {"url": f"{stub}/images/png{i}.avif"}}
+    ),
+    "avif_webp_cold": Scenario(
+        lambda i, stub: {
+            "method": "GET", "url": "/aviftonpng/to",
+            "params": {"url": f"{stub}/images/webp{i}.avif", "format": "webp", "width": "150"},
+        }
+    ),
+    "avif_hot": Scenario(
+        lambda i, stub: {"method": "GET", "url": "/aviftonpng/to", "params": {"url": f"{stub}/images/hot.avif"}}
+    ),
+    "groq": Scenario(lambda i, stub: _chat(i)),
+    "groq_stream": Scenario(lambda i, stub: _chat(i, stream=True)),
+    "github_batch": Scenario(lambda i, stub: _github_batch(i), max_requests=20, max_concurrency=1),
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    """进程的常驻内存（MB）：Linux 读 /proc，其他系统用 ps"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        output = subprocess.check_output(["ps", "-o", "rss=", "-p", str(pid)])
+        return int(output.strip()) / 1024
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def _start(module: str, port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+    )
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 20) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url} 启动失败，退出码 {proc.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} 在 {timeout}s 内没有就绪")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, stub: str, requests: int, concurrency: int, pid: int) -> dict:
+    requests = min(requests, scenario.max_requests or requests)
+    concurrency = min(concurrency, scenario.max_concurrency or concurrency)
+
+    # 预热：首次访问会加载路由模块、建立连接
+    warmup = await client.request(**scenario.build(-1, stub))
+    if warmup.status_code >= 400:
+        raise RuntimeError(f"预热请求失败: {warmup.status_code} {warmup.text[:200]}")
+
+    latencies: List[float] = []
+    errors = 0
+    next_index = 0
+    peak_rss = rss_mb(pid) or 0.0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < requests:
+            i = next_index
+            next_index += 1
+            start = time.perf_counter()
+            try:
+                # 流式响应也要读完整个响应体才算结束
+                response = await client.request(**scenario.build(i, stub))
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            peak_rss = max(peak_rss, rss_mb(pid) or 0.0)
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.ensure_future(sample_rss())
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "rps": requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "rss_mb": rss_mb(pid),
+        "peak_rss_mb": peak_rss,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """返回超过阈值的退化项"""
+    regressions = []
+    print(f"\n与基线比较（阈值 {threshold:.0%}）:")
+    print(f"{'scenario':<16}{'req/s':>18}{'p95 ms':>20}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        rps_delta = result["rps"] / base["rps"] - 1 if base["rps"] else 0
+        p95_delta = result["p95_ms"] / base["p95_ms"] - 1 if base["p95_ms"] else 0
+        flags = []
+        if rps_delta < -threshold:
+            flags.append("req/s")
+        if p95_delta > threshold:
+            flags.append("p95")
+        if flags:
+            regressions.append(f"{name}: {', '.join(flags)}")
+        print(
+            f"{name:<16}{base['rps']:>8.1f} -> {result['rps']:>7.1f}"
+            f"{base['p95_ms']:>9.1f} -> {result['p95_ms']:>7.1f}  {rps_delta:+.0%} / {p95_delta:+.0%}"
+            f"{'  <-- 退化' if flags else ''}"
+        )
+    return regressions
+
+
+async def run(args) -> dict:
+    names = args.only.split(",") if args.only else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"未知场景: {', '.join(unknown)}；可选: {', '.join(SCENARIOS)}")
+
+    stub_port, app_port = _free_port(), _free_port()
+    stub = f"http://127.0.0.1:{stub_port}"
+    base_env = dict(os.environ, PYTHONPATH=ROOT)
+    stub_env = dict(base_env, STUB_LATENCY_MS=str(args.latency_ms))
+    cache_dir = tempfile.mkdtemp(prefix="bench-avif-cache-")
+    app_env = dict(
+        base_env,
+        BQXS520_BASE_URL=stub,
+        PROXY_TARGET_URL=f"{stub}/cf.php",
+        GITHUB_API_BASE=f"{stub}/github",
+        GITHUB_RAW_BASE=f"{stub}/raw",
+        GROQ_BASE_URL=f"{stub}/openai/v1",
+        # 压测的是转发本身的开销，不让每个 API Key 的限流成为瓶颈
+        GROQ_KEY_RPM="0",
+        GROQ_KEY_TPM="0",
+        GROQ_KEY_MAX_CONCURRENCY=str(max(args.concurrency, 4)),
+        AVIF_DISK_CACHE_DIR=cache_dir,
+        # 转码队列至少能容纳全部并发请求，否则多出的请求会被准入控制直接 503
+        TRANSCODE_QUEUE_SIZE=str(max(args.concurrency, 4)),
+        LOG_LEVEL="WARNING",
+    )
+
+    stub_proc = _start("bench.stub_upstream:app", stub_port, stub_env)
+    app_proc = _start("main:app", app_port, app_env)
+    results = {}
+    try:
+        _wait_ready(f"{stub}/cf.php", stub_proc)
+        _wait_ready(f"http://127.0.0.1:{app_port}/", app_proc)
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", limits=limits, timeout=60) as client:
+            print(f"{'scenario':<16}{'n':>6}{'c':>4}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'err':>5}{'rss MB':>9}{'peak':>7}")
+            for name in names:
+                result = await run_scenario(client, SCENARIOS[name], stub, args.requests, args.concurrency, app_proc.pid)
+                results[name] = result
+                print(
+                    f"{name:<16}{result['requests']:>6}{result['concurrency']:>4}{result['rps']:>9.1f}"
+                    f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['errors']:>5}"
+                    f"{result['rss_mb'] or 0:>9.1f}{result['peak_rss_mb']:>7.1f}"
+                )
+    finally:
+        for proc in (app_proc, stub_proc):
+            proc.terminate()
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="离线基准测试")
+    parser.add_argument("-n", "--requests", type=int, default=200, help="每个场景的请求数")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="并发数")
+    parser.add_argument("--only", help="只跑这些场景，逗号分隔")
+    parser.add_argument("--latency-ms", type=float, default=20, help="模拟上游的额外延迟")
+    parser.add_argument("--save-baseline", help="把结果保存为基线 JSON")
+    parser.add_argument("--baseline", help="与之比较的基线 JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="req/s 下降或 p95 上升超过该比例视为退化")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n基线已保存到 {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\n性能退化: " + "; ".join(regressions), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
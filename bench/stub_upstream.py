@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+离线基准测试用的上游模拟服务，一个进程里提供所有路由依赖的外部接口：
+
+- /search.shtml、/book/{book_id}.shtml: 回放 bench/fixtures 里录制的 bqxs520 页面（BQXS520_BASE_URL 指向这里）
+- /images/{name}.avif: 返回 fixtures/cover.avif，带 ETag（AVIF 转换的 url 参数指向这里）。
+  文件末尾追加一个内容取决于 name 的 free box，不同 name 的文件内容不同，不会命中按内容寻址的转换缓存
+- /cf.php: 固定的 JSON（PROXY_TARGET_URL 指向这里）
+- /github/...: bench/fake_github.py 的假 GitHub API（GITHUB_API_BASE 指向 /github）
+- /openai/v1/chat/completions: 假的 Groq / OpenAI 接口，支持 stream（GROQ_BASE_URL 指向 /openai/v1）
+
+STUB_LATENCY_MS 为每个响应额外增加的延迟（毫秒，默认 20），模拟真实上游的网络耗时。
+
+用法:
+    uvicorn bench.stub_upstream:app --port 9100
+"""
+import asyncio
+import hashlib
+import json
+import os
+import struct
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from bench import fake_github
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+LATENCY = float(os.getenv("STUB_LATENCY_MS", "20")) / 1000
+
+
+def _fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURE_DIR, name), "rb") as f:
+        return f.read()
+
+
+SEARCH_HTML = _fixture("bqxs520_search.html")
+DETAIL_HTML = _fixture("bqxs520_detail.html")
+COVER_AVIF = _fixture("cover.avif")
+
+app = FastAPI()
+app.mount("/github", fake_github.app)
+
+
+async def _latency():
+    if LATENCY > 0:
+        await asyncio.sleep(LATENCY)
+
+
+@app.get("/search.shtml")
+async def search(key: str = ""):
+    await _latency()
+    return Response(content=SEARCH_HTML, media_type="text/html; charset=utf-8")
+
+
+@app.get("/book/{book_id}.shtml")
+async def detail(book_id: str):
+    await _latency()
+    return Response(content=DETAIL_HTML, media_type="text/html; charset=utf-8")
+
+
+def _avif_for(name: str) -> bytes:
+    # ISOBMFF 的顶层 free box 会被解码器跳过
+    payload = hashlib.sha1(name.encode()).digest()
+    return COVER_AVIF + struct.pack(">I", 8 + len(payload)) + b"free" + payload
+
+
+@app.get("/images/{name}.avif")
+async def image(name: str, request: Request):
+    await _latency()
+    content = _avif_for(name)
+    etag = '"' + hashlib.sha1(content).hexdigest() + '"'
+    headers = {"ETag": etag}
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type="image/avif", headers=headers)
+
+
+@app.get("/cf.php")
+async def cf():
+    await _latency()
+    return {"ip": "127.0.0.1", "colo": "LOCAL", "ts": int(time.time())}
+
+
+def _completion(model: str, content: str) -> dict:
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20},
+    }
+
+
+def _chunk(model: str, content: str) -> str:
+    chunk = {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat(request: Request):
+    body = await request.json()
+    model = body.get("model", "bench")
+    words = ["offline", "benchmark", "reply"]
+    if not body.get("stream"):
+        await _latency()
+        return JSONResponse(_completion(model, " ".join(words)))
+
+    async def events():
+        for word in words:
+            await _latency()
+            yield _chunk(model, word + " ")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
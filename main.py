@@ -1,16 +1,28 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import Response, JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import Response, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from public.usage import USAGE as html
-from api.hello import router as hello_router
-from api.bqxs520 import router as bqxs520_router
-from api.avif_converter import router as avif_router
-
-from api.upload_to_github import router as upload_router
+from api.common import http_client, metrics, parse_pool
+from api.common.lazy_routers import LAZY_ROUTERS, LazyRouterMiddleware, LazyRouterRegistry
+from api.common.http_client import get_http_client
+from api.common.cache import StaleWhileRevalidateCache, create_cache
+from api.common.compression import CompressionMiddleware, StaticAsset
+from api.common.metrics import MetricsMiddleware, phase
+from api.common.responses import FastJSONResponse
 import httpx
+import logging
+import os
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# 直接返回 dict 的路由也走 orjson
+app = FastAPI(default_response_class=FastJSONResponse)
+
+# 共享的 HTTP 连接池和解析池随应用启动/关闭
+app.add_event_handler("startup", http_client.startup)
+app.add_event_handler("shutdown", http_client.shutdown)
+app.add_event_handler("shutdown", parse_pool.shutdown)
 
 # 启用 CORS
 app.add_middleware(
@@ -21,19 +33,90 @@ app.add_middleware(
     allow_headers=["*"],  # 允许所有头部
 )
 
-app.include_router(hello_router, prefix="/hello")
-app.include_router(bqxs520_router, prefix="/bqxs520")
-app.
-app.include_router(avif_router, prefix="/aviftonpng")
-app.include_router(upload_router, prefix="/github")
+# 路由模块在第一次访问对应前缀时才导入，减少冷启动时间
+routers = LazyRouterRegistry(app)
+routers.register("/hello", "api.hello:router")
+routers.register("/bqxs520", "api.bqxs520:router")
+routers.register("/aviftonpng", "api.avif_converter:router")
+routers.register("/github", "api.upload_to_github:router")
+routers.register("/v1", "api.v1.groq:router")
+app.add_middleware(LazyRouterMiddleware, registry=routers)
+if not LAZY_ROUTERS:
+    app.add_event_handler("startup", routers.load_all)
+app.add_middleware(CompressionMiddleware)
+# 最后添加的中间件在最外层，这样统计的耗时包含路由的首次加载
+app.add_middleware(MetricsMiddleware)
+
+# 固定内容在启动时压缩好，请求时按 Accept-Encoding 直接返回
+PUBLIC_DIR = os.path.join(os.path.dirname(__file__), "public")
+usage_page = StaticAsset(html.encode("utf-8"), "text/html", cache_control="public, max-age=300")
+public_assets = {
+    "favicon.ico": StaticAsset.from_file(os.path.join(PUBLIC_DIR, "favicon.ico"), "image/x-icon"),
+    "vercel.png": StaticAsset.from_file(os.path.join(PUBLIC_DIR, "vercel.png"), "image/png"),
+}
 
 @app.get("/")
-def _root():
-    return Response(content=html, media_type="text/html")
+def _root(request: Request):
+    return usage_page.response(request)
+
+@app.get("/favicon.ico")
+def _favicon(request: Request):
+    return public_assets["favicon.ico"].response(request)
+
+@app.get("/public/{name}")
+def _public(name: str, request: Request):
+    asset = public_assets.get(name)
+    if asset is None:
+        return Response(status_code=404)
+    return asset.response(request)
+
+PROXY_TARGET_URL = os.getenv("PROXY_TARGET_URL", "https://ttdndd.serv00.net/cf.php")
+# 上游内容变化不频繁：TTL 内直接命中，过期后 PROXY_STALE_TTL 秒内先返回旧值并在后台刷新
+PROXY_CACHE_TTL = float(os.getenv("PROXY_CACHE_TTL", "30"))
+PROXY_STALE_TTL = float(os.getenv("PROXY_STALE_TTL", "300"))
+proxy_cache = StaleWhileRevalidateCache(
+    ttl=PROXY_CACHE_TTL,
+    stale_ttl=PROXY_STALE_TTL,
+    store=create_cache("proxy", max_entries=16, ttl=PROXY_CACHE_TTL + PROXY_STALE_TTL),
+)
+PROXY_TIMEOUT = float(os.getenv("PROXY_TIMEOUT", "10"))
 
 @app.get("/proxy")
-async def proxy(request: Request):
-    target_url = "https://ttdndd.serv00.net/cf.php"
-    async with httpx.AsyncClient() as client:
-        response = await client.get(target_url)
-        return JSONResponse(content=response.json(), media_type="application/json")
+async def proxy(request: Request, client: httpx.AsyncClient = Depends(get_http_client)):
+    async def fetch():
+        with phase("upstream"):
+            response = await client.get(PROXY_TARGET_URL, timeout=PROXY_TIMEOUT)
+        # 错误响应不能进缓存，否则会在 TTL + stale TTL 内一直返回给调用方
+        response.raise_for_status()
+        return response.json()
+
+    try:
+        payload = await proxy_cache.get(PROXY_TARGET_URL, fetch)
+    except (httpx.HTTPError, ValueError) as e:
+        logger.error(f"请求代理目标失败: {e}")
+        return FastJSONResponse(status_code=502, content={"error": "请求上游失败"})
+    return FastJSONResponse(content=payload)
+
+
+def _collect_metrics():
+    for host, stats in http_client.pool_stats().items():
+        yield "http_pool_connections", {"host": host}, stats["connections"]
+        yield "http_pool_idle_connections", {"host": host}, stats["idle"]
+    for host, stats in http_client.resilience_stats().items():
+        yield "http_breaker_open", {"host": host}, int(stats["breaker"] != "closed")
+        yield from metrics.stats_samples("http_upstream", stats, {"host": host})
+    yield "parse_pool_workers", {}, parse_pool.PARSER_POOL_SIZE
+    yield "parse_pool_pending", {}, parse_pool.pending
+    for name in ("hits", "stale_hits", "misses"):
+        yield f"cache_{name}", {"cache": "proxy"}, getattr(proxy_cache, name)
+    for row in routers.report():
+        yield "lazy_router_loaded", {"prefix": row["prefix"]}, int(row["loaded"])
+
+
+metrics.register_collector("main", _collect_metrics)
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus 文本格式的请求耗时直方图，以及连接池、缓存、队列的当前状态"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")